@@ -0,0 +1,127 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Chạy benchmark: mỗi scenario 1 process riêng (metric/module global không dính nhau), kết quả ghi ra JSON
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+QUICK = {
+    "alert_throughput": {"n": 3000},
+    "alert_latency": {"rate": 20, "duration": 5},
+    "rule_manager": {"n": 1000},
+    "deploy": {"n": 1000},
+}
+
+
+def _value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def run_child(name, params, result_path):
+    sys.path[:0] = [HERE, os.path.join(ROOT, "scripts")]
+    from scenarios import SCENARIOS
+    work = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    try:
+        with open(result_path, "w", encoding="utf-8") as f:
+            json.dump(SCENARIOS[name](work, **params), f)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def run_scenario(name, params):
+    fd, result_path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        t = time.perf_counter()
+        proc = subprocess.run([sys.executable, __file__, "--child", name, "--params", json.dumps(params), "--result", result_path],
+                              cwd=ROOT, capture_output=True, text=True)
+        if proc.returncode:
+            return {"error": (proc.stderr or proc.stdout).strip().splitlines()[-1:], "params": params}
+        with open(result_path, encoding="utf-8") as f:
+            res = json.load(f)
+        return {"params": params, "wall_seconds": round(time.perf_counter() - t, 2), **res}
+    finally:
+        os.remove(result_path)
+
+
+def compare(old, new, path=""):
+    # In chênh lệch các số đo giữa 2 lần chạy (giá trị thời gian tăng = chậm đi)
+    for k, v in new.items():
+        key = f"{path}.{k}" if path else k
+        before = old.get(k) if isinstance(old, dict) else None
+        if isinstance(v, dict):
+            compare(before or {}, v, key)
+        elif isinstance(v, (int, float)) and isinstance(before, (int, float)) and before and not isinstance(v, bool):
+            print(f"  {key:<55} {before:>12} -> {v:<12} ({(v - before) / before * 100:+.1f}%)")
+
+
+def git_sha():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    from scenarios import SCENARIOS
+    ap = argparse.ArgumentParser(description="Benchmark alert pipeline / Rule Manager / deploy với server giả lập local")
+    ap.add_argument("scenarios", nargs="*", help=f"mặc định chạy hết: {', '.join(SCENARIOS)}")
+    ap.add_argument("--set", action="append", default=[], metavar="SCENARIO.PARAM=VALUE",
+                    help="ghi đè tham số, vd. alert_throughput.n=50000 hoặc deploy.kibana_error_rate=0.05")
+    ap.add_argument("--quick", action="store_true", help="kích thước nhỏ để kiểm tra nhanh")
+    ap.add_argument("--out", help="file JSON kết quả (mặc định benchmarks/results/<thời điểm>.json)")
+    ap.add_argument("--compare", help="file JSON của lần chạy trước để so sánh")
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    ap.add_argument("--params", help=argparse.SUPPRESS)
+    ap.add_argument("--result", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+    if args.child:
+        return run_child(args.child, json.loads(args.params), args.result)
+
+    names = args.scenarios or list(SCENARIOS)
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        ap.error(f"unknown scenario: {', '.join(unknown)}")
+    params = {n: dict(QUICK[n]) if args.quick else {} for n in names}
+    for item in args.set:
+        key, _, value = item.partition("=")
+        name, _, param = key.partition(".")
+        if name in params:
+            params[name][param] = _value(value)
+
+    report = {"meta": {"started": datetime.now().isoformat(timespec="seconds"), "git": git_sha(),
+                       "python": platform.python_version(), "platform": platform.platform(),
+                       "cpus": os.cpu_count(), "quick": args.quick},
+              "scenarios": {}}
+    for name in names:
+        print(f"[*] {name} {params[name] or ''}", flush=True)
+        report["scenarios"][name] = res = run_scenario(name, params[name])
+        print(json.dumps(res, indent=2, ensure_ascii=False), flush=True)
+
+    out = args.out or os.path.join(HERE, "results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"[+] Results written to {out}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            old = json.load(f)
+        print(f"[*] Compared with {args.compare} ({old['meta'].get('git')}):")
+        compare(old.get("scenarios", {}), report["scenarios"])
+    return 1 if any("error" in r for r in report["scenarios"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, HERE)
+    sys.exit(main())
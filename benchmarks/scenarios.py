@@ -0,0 +1,252 @@
+import contextlib
+import io
+import os
+import re
+import statistics
+import threading
+import time
+from synth import generate_alerts, alert_source, iso, write_sigma_rules, write_ndjson
+from standins import FakeElasticsearch, FakeKibana, FakeTelegram
+
+# Mỗi scenario chạy trong 1 process riêng (run.py), nhận thư mục tạm + tham số, trả về dict kết quả
+
+
+def _pct(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 4)
+
+
+def _monitor_env(work, es, tg, **extra):
+    os.environ.update({
+        "ELASTIC_HOST": es.url, "ELASTIC_USER": "bench", "ELASTIC_PASS": "bench",
+        "TELEGRAM_TOKEN": "bench", "TELEGRAM_CHAT_ID": "1", "TELEGRAM_API_URL": tg.url,
+        "ALERT_TARGETS": "BENCH=bench-alerts", "ALERT_METRICS_SUMMARY": "0",
+        "ALERT_CHECKPOINT_FILE": os.path.join(work, ".alert_checkpoint_{label}.json"),
+        "ALERT_SPILL_FILE": os.path.join(work, ".alert_undelivered.jsonl"),
+        **{k: str(v) for k, v in extra.items()},
+    })
+
+
+def _run_monitor(monitor, milestones, timeout):
+    # milestones {tên: điều kiện}: ghi lại thời điểm từng điều kiện đạt được, dừng monitor khi đạt hết (hoặc timeout)
+    logs, reached = [], {}
+    monitor.running = True
+    t = threading.Thread(target=monitor.run_logic, args=(logs.append,), daemon=True)
+    t0 = time.perf_counter()
+    t.start()
+    deadline = time.monotonic() + timeout
+    while len(reached) < len(milestones) and time.monotonic() < deadline:
+        for name, cond in milestones.items():
+            if name not in reached and cond():
+                reached[name] = round(time.perf_counter() - t0, 3)
+        time.sleep(0.02)
+    monitor.running = False
+    t.join(30)
+    return reached, logs
+
+
+def alert_throughput(work, n=20000, pattern="burst", cardinality=200, evidence_bytes=500,
+                     es_latency=0.005, tg_latency=0.02, tg_error_rate=0.0, coalesce_window=60, slices=1,
+                     slice_workers="thread", send_rate=1.0, send_burst=3, timeout=300):
+    # Catch-up: n alert đã nằm sẵn trong index (monitor vừa bật lại sau downtime), đo thời gian xả hết backlog
+    es = FakeElasticsearch(latency=es_latency).start()
+    tg = FakeTelegram(latency=tg_latency, error_rate=tg_error_rate).start()
+    try:
+        start = time.time() - 3600
+        es.add(generate_alerts(n, start, 3000, pattern, cardinality, evidence_bytes))
+        _monitor_env(work, es, tg, ALERT_IDLE_INTERVAL=0.2, ALERT_COALESCE_WINDOW=coalesce_window,
+                     ALERT_SLICES=slices, ALERT_SLICE_WORKERS=slice_workers,
+                     ALERT_SEND_RATE=send_rate, ALERT_SEND_BURST=send_burst)
+        from checkpoint import CheckpointStore
+        CheckpointStore(os.path.join(work, ".alert_checkpoint_bench.json")).save(
+            {"index": "bench-alerts", "checkpoint": iso(start - 1), "sort": None, "seen": []})
+        from alert import AlertMonitor
+        monitor = AlertMonitor()
+        target = monitor.targets[0]
+        # drained: đã đọc hết backlog từ ES; delivered: hàng đợi Telegram cũng đã gửi xong
+        reached, logs = _run_monitor(monitor, {
+            "drained": lambda: not target.catching_up,
+            "delivered": lambda: not target.catching_up and monitor.notifier.queue.unfinished_tasks == 0,
+        }, timeout)
+        delivery = monitor.notifier.metrics()
+        drain = reached.get("drained")
+        return {
+            "alerts": n, "drain_seconds": drain, "alerts_per_second": round(n / drain, 1) if drain else None,
+            "delivered_seconds": reached.get("delivered"),
+            "polls": target.stats["polls"], "es_searches": es.searches, "hits": target.stats["hits"], "groups": target.stats["groups"],
+            "poll_errors": target.stats["errors"], "search_ms_per_poll": round(target.stats["search_ms"] / max(1, target.stats["polls"]), 2),
+            "telegram_received": len(tg.messages), "telegram_injected_errors": tg.stats["injected_errors"],
+            "delivery": {k: delivery[k] for k in ("sent", "messages", "rate_limited", "failed", "dropped", "retries", "depth",
+                                                  "high_watermark")},
+            "coalescer": dict(target.coalescer.stats),
+        }
+    finally:
+        es.stop(); tg.stop()
+
+
+def alert_latency(work, rate=50, duration=20, evidence_bytes=200, es_latency=0.005, tg_latency=0.02,
+                  idle_interval=2.0, send_rate=1.0, send_burst=3, timeout=60):
+    # Real-time: alert được ghi vào index với @timestamp = now, đo từ @timestamp tới lúc Telegram giả nhận tin
+    es = FakeElasticsearch(latency=es_latency).start()
+    tg = FakeTelegram(latency=tg_latency).start()
+    try:
+        _monitor_env(work, es, tg, ALERT_IDLE_INTERVAL=idle_interval, ALERT_COALESCE_WINDOW=0,
+                     ALERT_SEND_RATE=send_rate, ALERT_SEND_BURST=send_burst)
+        from alert import AlertMonitor
+        import random
+        monitor = AlertMonitor()
+        total = int(rate * duration)
+        sent_at = {}
+
+        def feed():
+            # Mỗi alert 1 fingerprint riêng (fp = số thứ tự) -> tìm lại được thời điểm phát sinh từ evidence trong tin nhắn
+            rnd = random.Random(1)
+            # @timestamp bị cắt còn ms: lùi 5ms để alert đầu không rơi trước checkpoint ban đầu (độ chính xác µs) của monitor
+            t_start = time.time() + 0.005
+            for i in range(total):
+                delay = t_start + i / rate - time.time()
+                if delay > 0: time.sleep(delay)
+                now = time.time()
+                sent_at[i] = now
+                es.add([{"_id": f"live-{i}", "_source": alert_source(now, i, evidence_bytes, rnd)}])
+
+        def delivered():
+            # 1 tin Telegram có thể là digest nhiều alert: lấy thời điểm nhận cho từng alert trong tin
+            got = {}
+            for recv, text in list(tg.messages):
+                for fp in re.findall(r"/p(\d+)\.ps1", text):
+                    if int(fp) in sent_at:
+                        got.setdefault(int(fp), recv)
+            return got
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        reached, _ = _run_monitor(monitor, {"done": lambda: not feeder.is_alive() and len(delivered()) >= total},
+                                  duration + timeout)
+        got = delivered()
+        lat = [recv - sent_at[fp] for fp, recv in got.items()]
+        return {
+            "alerts": total, "rate": rate, "delivered": len(lat), "messages": len(tg.messages), "seconds": reached.get("done"),
+            "e2e_p50": _pct(lat, 0.5), "e2e_p95": _pct(lat, 0.95), "e2e_max": round(max(lat), 4) if lat else None,
+            "e2e_mean": round(statistics.mean(lat), 4) if lat else None,
+            "polls": monitor.targets[0].stats["polls"], "idle_interval": idle_interval,
+        }
+    finally:
+        es.stop(); tg.stop()
+
+
+class FakeTree:
+    # Đủ API ttk.Treeview mà RuleManager dùng, không cần màn hình
+    def __init__(self):
+        self.order, self.rows = [], {}
+
+    def get_children(self, item=""):
+        return tuple(self.order)
+
+    def delete(self, *iids):
+        drop = set(iids)
+        self.order = [i for i in self.order if i not in drop]
+        for i in iids: self.rows.pop(i, None)
+
+    def exists(self, iid):
+        return iid in self.rows
+
+    def item(self, iid, option=None, **kw):
+        if kw: self.rows[iid].update(kw)
+        return self.rows[iid].get(option) if option else self.rows[iid]
+
+    def move(self, iid, parent, pos):
+        self.order.remove(iid); self.order.insert(pos, iid)
+
+    def insert(self, parent, pos, iid=None, **kw):
+        self.order.insert(pos, iid); self.rows[iid] = kw
+        return iid
+
+    def selection(self):
+        return ()
+
+
+class _Frame:
+    def pack(self, **kw): pass
+    def pack_forget(self): pass
+
+
+def rule_manager(work, n=10000, terms=("powershell", "variant 99", "t1042", "cat_00", "zzz-nomatch")):
+    rules = os.path.join(work, "rules")
+    t = time.perf_counter()
+    write_sigma_rules(rules, n)
+    gen = time.perf_counter() - t
+    os.chdir(work)
+    os.environ["RULE_CATALOG_FILE"] = os.path.join(work, ".rule_catalog.json")
+    from manager import RuleManager
+    log = []
+    out = {"rules": n, "generate_seconds": round(gen, 3)}
+
+    t = time.perf_counter()
+    rm = RuleManager(rules, log.append); rm.load_rules_data()
+    out["cold_load_seconds"] = round(time.perf_counter() - t, 3)
+    t = time.perf_counter()
+    rm = RuleManager(rules, log.append); rm.load_rules_data()
+    out["warm_load_seconds"] = round(time.perf_counter() - t, 3)
+
+    for p in sorted(rm.catalog.entries)[:10]:
+        with open(p, "a", encoding="utf-8") as f: f.write("# edited\n")
+    t = time.perf_counter(); rm.load_rules_data()
+    out["refresh_10_changed_seconds"] = round(time.perf_counter() - t, 3)
+
+    tree, frame = FakeTree(), _Frame()
+    out["search"] = {}
+    for term in terms:
+        t = time.perf_counter()
+        rm.filter_logic(term, "File Mode", tree, frame)
+        first = time.perf_counter() - t
+        t = time.perf_counter()
+        while True:
+            before = len(tree.order)
+            rm.load_more(tree)
+            if len(tree.order) == before: break
+        out["search"][term] = {"first_page_ms": round(first * 1000, 2), "all_rows": len(tree.order),
+                               "scroll_all_ms": round((time.perf_counter() - t) * 1000, 2)}
+    t = time.perf_counter()
+    rm.filter_logic("cat_0", "Folder Mode", tree, frame)
+    out["folder_search_ms"] = round((time.perf_counter() - t) * 1000, 2)
+    return out
+
+
+def deploy_stages(work, n=5000, query_bytes=1500, kibana_latency=0.05, kibana_error_rate=0.0, workers=4):
+    # patch_ndjson + import_rules + delete_rules của deploy.py với Kibana giả
+    kb = FakeKibana(latency=kibana_latency, error_rate=kibana_error_rate).start()
+    try:
+        os.environ.update({"KIBANA_URL": kb.url, "ELASTIC_USERNAME": "bench", "ELASTIC_PASSWORD": "bench",
+                           "KIBANA_SPACE": "default", "IMPORT_WORKERS": str(workers),
+                           "DEPLOY_CACHE_DIR": os.path.join(work, ".deploy_cache")})
+        os.makedirs(os.path.join(work, "rules"), exist_ok=True)
+        os.chdir(work)
+        import deploy
+        ids = write_ndjson(deploy.NDJSON_OUTPUT, n, query_bytes)
+        size = os.path.getsize(deploy.NDJSON_OUTPUT)
+        out = {"rules": n, "ndjson_bytes": size, "workers": workers}
+        with contextlib.redirect_stdout(io.StringIO()):
+            t = time.perf_counter(); deploy.patch_ndjson(ids[::10])
+            out["patch_seconds"] = round(time.perf_counter() - t, 3)
+            t = time.perf_counter(); failed = deploy.import_rules()
+            out["import_seconds"] = round(time.perf_counter() - t, 3)
+            t = time.perf_counter(); deleted = deploy.delete_rules(ids[: n // 2])
+            out["delete_seconds"] = round(time.perf_counter() - t, 3)
+        out.update({"patch_mb_per_second": round(size / 1e6 / max(out["patch_seconds"], 1e-9), 1),
+                    "import_failed": None if failed is None else len(failed), "imported": kb.imported,
+                    "deleted": len(deleted), "kibana_requests": kb.stats["requests"],
+                    "kibana_injected_errors": kb.stats["injected_errors"]})
+        return out
+    finally:
+        kb.stop()
+
+
+SCENARIOS = {
+    "alert_throughput": alert_throughput,
+    "alert_latency": alert_latency,
+    "rule_manager": rule_manager,
+    "deploy": deploy_stages,
+}
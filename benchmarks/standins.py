@@ -0,0 +1,260 @@
+import bisect
+import hashlib
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from dateutil import parser
+
+# Server HTTP giả lập Elasticsearch / Kibana / Telegram cho benchmark: chạy local, có thể chèn độ trễ và tỉ lệ lỗi
+
+SOURCE_FIELDS = None  # nạp lười từ queries.py (scripts/ đã nằm trong sys.path khi chạy benchmark)
+
+
+class StandIn:
+    def __init__(self, latency=0.0, error_rate=0.0, seed=1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "injected_errors": 0}
+        self.server = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        standin = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive như server thật
+
+            def _handle(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                status, payload, headers = standin.dispatch(self.command, self.path, self.headers, body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                for k, v in {"Content-Type": "application/json", **headers}.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("X-Elastic-Product", "Elasticsearch")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def dispatch(self, method, path, headers, body):
+        with self.lock:
+            self.stats["requests"] += 1
+            fail = self.rnd.random() < self.error_rate
+            if fail:
+                self.stats["injected_errors"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            return self.error()
+        return self.route(method, urlsplit(path), headers, body)
+
+    def error(self):
+        return 503, {"error": "injected"}, {}
+
+    def route(self, method, url, headers, body):
+        return 404, {}, {}
+
+
+class FakeElasticsearch(StandIn):
+    # Chỉ hỗ trợ đúng dạng query của queries.py: build_poll_query (range gt, search_after) và
+    # build_slice_query (point-in-time + slice, range gt/lte)
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.keys = []   # (ts_ms, seq) tăng dần
+        self.docs = []
+        self.searches = 0
+        self.pits = {}   # pit id -> số document lúc mở (PIT không thấy document ghi sau đó)
+
+    def add(self, hits):
+        with self.lock:
+            for hit in hits:
+                ts_ms = int(parser.isoparse(hit["_source"]["@timestamp"]).timestamp() * 1000)
+                key = (ts_ms, len(self.keys))
+                self.keys.append(key)
+                self.docs.append(dict(hit, sort=list(key)))
+
+    def __len__(self):
+        return len(self.docs)
+
+    def error(self):
+        return 503, {"error": {"type": "unavailable_shards_exception", "reason": "injected"}, "status": 503}, \
+            {"X-Elastic-Product": "Elasticsearch"}
+
+    def route(self, method, url, headers, body):
+        product = {"X-Elastic-Product": "Elasticsearch"}
+        if url.path.endswith("/_pit"):
+            with self.lock:
+                if method == "DELETE":
+                    self.pits.pop(json.loads(body or b"{}").get("id"), None)
+                    return 200, {"succeeded": True, "num_freed": 1}, product
+                pit_id = f"pit-{len(self.pits)}-{self.rnd.getrandbits(32)}"
+                self.pits[pit_id] = len(self.docs)
+            return 200, {"id": pit_id}, product
+        if not url.path.endswith("/_search"):
+            return 200, {"version": {"number": "8.15.0"}, "tagline": "You Know, for Search"}, product
+        global SOURCE_FIELDS
+        if SOURCE_FIELDS is None:
+            from queries import SOURCE_FIELDS
+        q = json.loads(body or b"{}")
+        if "pit" in q:
+            return self._search_slice(q, product)
+        gt = q["query"]["bool"]["must"][0]["range"]["@timestamp"]["gt"]
+        start_key = (int(parser.isoparse(gt).timestamp() * 1000), float("inf"))
+        if q.get("search_after"):
+            start_key = max(start_key, tuple(q["search_after"]))
+        with self.lock:
+            self.searches += 1
+            i = bisect.bisect_right(self.keys, start_key)
+            page = self.docs[i:i + q.get("size", 10)]
+        script = (q.get("script_fields") or {}).get("evidence", {}).get("script", {}).get("params")
+        return 200, {"took": 1, "timed_out": False,
+                     "hits": {"total": {"value": len(page), "relation": "gte"},
+                              "hits": [self._render(d, script) for d in page]}}, product
+
+    def _search_slice(self, q, product):
+        rng = q["query"]["bool"]["filter"][0]["range"]["@timestamp"]
+        gt, lte = (int(parser.isoparse(rng[k]).timestamp() * 1000) for k in ("gt", "lte"))
+        start_key = (gt, float("inf"))
+        if q.get("search_after"):
+            start_key = max(start_key, tuple(q["search_after"]))
+        sl = q.get("slice") or {"id": 0, "max": 1}
+        size = q.get("size", 10)
+        with self.lock:
+            self.searches += 1
+            limit = self.pits.get(q["pit"]["id"])
+            if limit is None:
+                return 404, {"error": {"type": "search_context_missing_exception"}, "status": 404}, product
+            page = []
+            for i in range(bisect.bisect_right(self.keys, start_key), limit):
+                if self.keys[i][0] > lte or len(page) >= size:
+                    break
+                doc = self.docs[i]
+                # Slice theo hash của _id như Elasticsearch: mỗi document thuộc đúng 1 slice
+                if zlib.crc32(doc["_id"].encode()) % sl["max"] == sl["id"]:
+                    page.append(doc)
+        script = (q.get("script_fields") or {}).get("evidence", {}).get("script", {}).get("params")
+        return 200, {"pit_id": q["pit"]["id"], "took": 1, "timed_out": False,
+                     "hits": {"total": {"value": len(page), "relation": "gte"},
+                              "hits": [self._render(d, script) for d in page]}}, product
+
+    @staticmethod
+    def _render(doc, script):
+        src = doc["_source"]
+        hit = {"_index": "bench", "_id": doc["_id"], "sort": doc["sort"],
+               "_source": {k: v for k, v in src.items() if any(f == k or f.startswith(k + ".") for f in SOURCE_FIELDS)}}
+        if script:
+            # Giống EVIDENCE_SCRIPT: [evidence cắt max ký tự, sha1 của bản đầy đủ]
+            for p in script["paths"]:
+                v = src.get(p)
+                if v:
+                    v = str(v).strip()
+                    hit["fields"] = {"evidence": [v[:script["max"]], hashlib.sha1(v.encode()).hexdigest()]}
+                    break
+        return hit
+
+
+class FakeKibana(StandIn):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.rules = {}
+        self.imported = 0
+        self.deleted = 0
+
+    def route(self, method, url, headers, body):
+        path = url.path
+        if path.endswith("/_import"):
+            ok, errors = 0, []
+            for line in self._multipart_file(headers, body).splitlines():
+                if not line.strip():
+                    continue
+                rule = json.loads(line)
+                with self.lock:
+                    self.rules[rule["rule_id"]] = rule
+                ok += 1
+            with self.lock:
+                self.imported += ok
+            return 200, {"success": not errors, "success_count": ok, "errors": errors}, {}
+        if path.endswith("/_bulk_delete"):
+            out = []
+            with self.lock:
+                for item in json.loads(body):
+                    rid = item["rule_id"]
+                    if self.rules.pop(rid, None) is None:
+                        out.append({"rule_id": rid, "error": {"status_code": 404, "message": f"rule_id: \"{rid}\" not found"}})
+                    else:
+                        self.deleted += 1
+                        out.append({"rule_id": rid, "id": rid})
+            return 200, out, {}
+        if path.endswith("/_find"):
+            qs = parse_qs(url.query)
+            page, per_page = int(qs.get("page", ["1"])[0]), int(qs.get("per_page", ["20"])[0])
+            fields = qs.get("fields")
+            with self.lock:
+                rules = list(self.rules.values())
+            data = rules[(page - 1) * per_page: page * per_page]
+            if fields:
+                data = [{k: r.get(k) for k in fields} for r in data]
+            return 200, {"page": page, "perPage": per_page, "total": len(rules), "data": data}, {}
+        return 404, {"message": "Not Found"}, {}
+
+    @staticmethod
+    def _multipart_file(headers, body):
+        boundary = headers.get("Content-Type", "").split("boundary=")[-1].encode()
+        for part in body.split(b"--" + boundary):
+            head, _, content = part.partition(b"\r\n\r\n")
+            if b"filename=" in head:
+                return content.rsplit(b"\r\n", 1)[0].decode()
+        return ""
+
+
+class FakeTelegram(StandIn):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.messages = []   # (thời điểm nhận, text)
+
+    def error(self):
+        # Telegram báo flood control bằng 429 + retry_after
+        return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                     "parameters": {"retry_after": 1}}, {"Retry-After": "1"}
+
+    def route(self, method, url, headers, body):
+        if not url.path.endswith("/sendMessage"):
+            return 404, {"ok": False, "error_code": 404}, {}
+        if "json" in headers.get("Content-Type", ""):
+            text = json.loads(body).get("text", "")
+        else:
+            text = parse_qs(body.decode()).get("text", [""])[0]
+        with self.lock:
+            self.messages.append((time.time(), text))
+            mid = len(self.messages)
+        return 200, {"ok": True, "result": {"message_id": mid}}, {}
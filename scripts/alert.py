@@ -1,20 +1,167 @@
 import os
 import subprocess
+import threading
 import time
-import requests
 import urllib3
 import logging
-from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from dotenv import load_dotenv
-from elasticsearch import Elasticsearch
-from dateutil import tz, parser
+from dateutil import parser
 from datetime import datetime, timezone, timedelta
+import http_client
+from notifier import TelegramNotifier, SEND_SECONDS, E2E_SECONDS
+from dedup import DedupIndex
+from checkpoint import CheckpointStore
+from queries import build_poll_query, build_aggregation_query, build_slice_query, PAGE_SIZE
+from records import AlertRecord, render_message
+from coalescer import AlertCoalescer
+from scheduler import PollScheduler
+from metrics import REGISTRY, start_http_server
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 logging.getLogger("elasticsearch").setLevel(logging.ERROR)
 load_dotenv()
 
+POLLS = REGISTRY.counter("alert_polls_total", "Elasticsearch polls issued", ["target"])
+POLL_ERRORS = REGISTRY.counter("alert_poll_errors_total", "Polls that raised an error", ["target"])
+HITS = REGISTRY.counter("alert_hits_total", "Alert documents received (bucket doc_count in server mode)", ["target"])
+DEDUP_DROPS = REGISTRY.counter("alert_dedup_drops_total", "Hits skipped because their ID was already processed", ["target"])
+GROUPS = REGISTRY.counter("alert_groups_total", "Fingerprint groups produced by aggregation", ["target"])
+SEARCH_SECONDS = REGISTRY.histogram("alert_es_search_seconds", "Latency of es.search calls", ["target"])
+PAGE_SECONDS = REGISTRY.histogram("alert_page_process_seconds", "Time to decode, dedup and aggregate one page", ["target"])
+CHECKPOINT_LAG = REGISTRY.gauge("alert_checkpoint_lag_seconds", "Now minus the persisted checkpoint", ["target"])
+INGEST_LAG = REGISTRY.gauge("alert_ingest_lag_seconds", "Now minus the newest processed @timestamp", ["target"])
+DEDUP_SIZE = REGISTRY.gauge("alert_dedup_cache_size", "Alert IDs held in the dedup index", ["target"])
+DEDUP_LOOKUPS = REGISTRY.counter("alert_dedup_lookups_total", "Dedup index lookups by result (hit/miss)", ["target", "result"])
+DEDUP_EVICTIONS = REGISTRY.counter("alert_dedup_evictions_total", "IDs evicted from the dedup index (size: capacity full, age: behind checkpoint)", ["target", "reason"])
+POLL_DELAY = REGISTRY.gauge("alert_poll_delay_seconds", "Delay chosen by the poll scheduler before the next poll", ["target"])
+POLL_ERROR_STREAK = REGISTRY.gauge("alert_poll_consecutive_errors", "Consecutive failed polls (drives the backoff)", ["target"])
+COALESCER_SIZE = REGISTRY.gauge("alert_coalescer_open", "Fingerprints held open by the coalescer", ["target"])
+QUEUE_DEPTH = REGISTRY.gauge("alert_delivery_queue_depth", "Messages waiting in the Telegram queue")
+SLICED_WINDOWS = REGISTRY.counter("alert_sliced_windows_total", "Catch-up windows consumed with sliced point-in-time search", ["target"])
+
+
+def parse_targets(spec):
+    # "PROD=.internal.alerts-security.alerts-default-*,TENANT_A=alerts-tenant-a-*" -> [(label, index), ...]
+    targets = []
+    for item in spec.split(","):
+        if "=" in item:
+            label, index = item.split("=", 1)
+            targets.append((label.strip().upper(), index.strip()))
+    return targets
+
+
+_slice_es = None
+
+
+def _init_slice_worker(host, auth):
+    # ALERT_SLICE_WORKERS=process: mỗi process tự có 1 client Elasticsearch
+    global _slice_es
+    from elasticsearch import Elasticsearch
+    _slice_es = Elasticsearch(host, basic_auth=auth, verify_certs=False)
+
+
+def consume_slice(pit_id, slice_id, slices, start, end, seen, es=None):
+    # Đọc hết 1 slice của cửa sổ (start, end], dedup + gộp theo fingerprint ngay tại worker.
+    # Trả về groups {fp: [record đầu tiên, count, first_time, last_time, first_ms, last_ms]}, id mới, số hit, số bị dedup, thời gian search
+    es = es or _slice_es
+    groups, new_ids, total, dropped, search_seconds = {}, [], 0, 0, 0.0
+    after = None
+    while True:
+        start_t = time.perf_counter()
+        res = es.search(body=build_slice_query(pit_id, slice_id, slices, start, end, after))
+        search_seconds += time.perf_counter() - start_t
+        pit_id = res.get('pit_id', pit_id)
+        hits = res['hits']['hits']
+        total += len(hits)
+        for hit in hits:
+            if hit['_id'] in seen:
+                dropped += 1
+                continue
+            record = AlertRecord.from_hit(hit)
+            ts = record.sort[0]
+            new_ids.append((hit['_id'], ts))
+            group = groups.get(record.fingerprint)
+            if group is None:
+                groups[record.fingerprint] = [record, 1, record.timestamp, record.timestamp, ts, ts]
+            else:
+                group[1] += 1
+                group[3], group[5] = record.timestamp, ts
+        if len(hits) < PAGE_SIZE:
+            return groups, new_ids, total, dropped, search_seconds
+        after = hits[-1]['sort']
+
+
+def merge_slices(parts):
+    # Gộp kết quả các slice: count cộng dồn, record/first lấy của hit sớm nhất, last của hit muộn nhất
+    merged, new_ids, total, dropped = {}, [], 0, 0
+    for groups, ids, n, d, _ in parts:
+        total += n
+        dropped += d
+        new_ids += ids
+        for fp, g in groups.items():
+            m = merged.get(fp)
+            if m is None:
+                merged[fp] = g
+                continue
+            m[1] += g[1]
+            if g[4] < m[4]:
+                m[0], m[2], m[4] = g[0], g[2], g[4]
+            if g[5] > m[5]:
+                m[3], m[5] = g[3], g[5]
+    new_ids.sort(key=lambda x: x[1])
+    return merged, new_ids, total, dropped
+
+
+class MonitorTarget:
+    # Trạng thái riêng của 1 index được giám sát: checkpoint, dedup, lịch poll, thống kê
+    def __init__(self, label, index, scheduler, coalescer, checkpoint_store, agg_mode="client"):
+        self.label = label
+        self.agg_mode = agg_mode
+        self.index = index
+        self.scheduler = scheduler
+        self.coalescer = coalescer
+        self.checkpoint_store = checkpoint_store
+        self.last_checkpoint = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        self.last_sort_value = None
+        # ALERT_AGG_MODE=server: cửa sổ đang đọc dở {"end", "after"} (after_key của page cuối đã giao)
+        self.agg_cursor = None
+        self.sent_alerts_cache = DedupIndex(max_size=int(os.getenv("ALERT_DEDUP_SIZE", "50000")))
+        self.stats = {"polls": 0, "hits": 0, "groups": 0, "errors": 0, "search_ms": 0.0}
+        self.catching_up = self.restore_state()
+
+    def restore_state(self):
+        state = self.checkpoint_store.load()
+        if not state or state.get("index") != self.index:
+            return False
+        self.last_checkpoint = state["checkpoint"]
+        self.last_sort_value = state.get("sort")
+        # Cursor chỉ có nghĩa ở server mode và khi cửa sổ của nó còn nằm sau checkpoint; đổi mode hay cursor cũ
+        # mà vẫn dùng thì checkpoint bị kéo về cursor["end"] cũ -> báo lại cửa sổ đã xử lý
+        cursor = state.get("agg")
+        if cursor and self.agg_mode == "server" and parser.isoparse(cursor["end"]) > parser.isoparse(self.last_checkpoint):
+            self.agg_cursor = cursor
+        self.sent_alerts_cache.restore(state.get("seen", []))
+        print(f"[*] Resuming {self.label} from checkpoint {self.last_checkpoint}")
+        return True
+
+    def save_state(self):
+        self.checkpoint_store.save({
+            "index": self.index,
+            "checkpoint": self.last_checkpoint,
+            "sort": self.last_sort_value,
+            "agg": self.agg_cursor,
+            "seen": self.sent_alerts_cache.snapshot(),
+            "saved_at": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        })
+
+    def snapshot(self):
+        return dict(self.stats, label=self.label, index=self.index, checkpoint=self.last_checkpoint,
+                    ingest_lag=self.scheduler.ingest_lag, dedup_size=len(self.sent_alerts_cache),
+                    coalescing=len(self.coalescer))
+
+
 class AlertMonitor:
-    def __init__(self):
+    def __init__(self, targets=None, scheduler_factory=None, notifier=None, clock=time.time):
         self.branch = self._get_current_branch()
         print(f"[*] Detected Environment: {self.branch.upper()}")
 
@@ -22,142 +169,366 @@ class AlertMonitor:
         self.AUTH = (os.getenv("ELASTIC_USER"), os.getenv("ELASTIC_PASS"))
         self.TOKEN = os.getenv("TELEGRAM_TOKEN")
         self.CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
-        
+
         env_settings = {
             "main": {"index": os.getenv("INDEX_PROD"), "label": "PROD"},
             "dev":  {"index": os.getenv("INDEX_DEV"),  "label": "DEV"}
         }
 
-        current_config = env_settings.get(self.branch, env_settings["dev"])
-        self.INDEX = current_config["index"]
-        self.ENV_LABEL = current_config["label"]
-        self.es = Elasticsearch(self.ELASTIC_HOST, basic_auth=self.AUTH, verify_certs=False)
-        self.running = False 
-        self.last_checkpoint = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
-        self.last_sort_value = None
-        self.sent_alerts_cache = deque(maxlen=500)
+        # ALERT_TARGETS cho phép giám sát nhiều index cùng lúc, mặc định vẫn chọn theo nhánh git
+        targets = targets or parse_targets(os.getenv("ALERT_TARGETS", ""))
+        if not targets:
+            current_config = env_settings.get(self.branch, env_settings["dev"])
+            targets = [(current_config["label"], current_config["index"])]
+        self.ENV_LABEL = "+".join(label for label, _ in targets)
+
+        self._es = None
+        self._es_lock = threading.Lock()
+        self.running = False
+        self.agg_mode = os.getenv("ALERT_AGG_MODE", "client").lower()
+        # clock: nguồn thời gian cho cửa sổ gộp (replay truyền đồng hồ ảo theo @timestamp)
+        self.clock = clock
+        self.notifier = notifier or TelegramNotifier(
+            self.TOKEN, self.CHAT_ID,
+            max_queue=int(os.getenv("ALERT_QUEUE_SIZE", "1000")),
+            workers=int(os.getenv("ALERT_SEND_WORKERS", "2")),
+            rate=float(os.getenv("ALERT_SEND_RATE", "1")),
+            burst=float(os.getenv("ALERT_SEND_BURST", "3")),
+            max_length=int(os.getenv("ALERT_DIGEST_MAX", "4096")),
+            shutdown_timeout=float(os.getenv("ALERT_SHUTDOWN_TIMEOUT", "30")),
+            spill_path=os.getenv("ALERT_SPILL_FILE", ".alert_undelivered.jsonl")
+        )
+        scheduler_factory = scheduler_factory or (lambda: PollScheduler(
+            idle_interval=float(os.getenv("ALERT_IDLE_INTERVAL", "2")),
+            backoff_max=float(os.getenv("ALERT_BACKOFF_MAX", "60"))
+        ))
+        # Catch-up song song: cửa sổ backlog chia cho ALERT_SLICES worker qua point-in-time + sliced search
+        self.slices = int(os.getenv("ALERT_SLICES", "1"))
+        self.slice_workers = os.getenv("ALERT_SLICE_WORKERS", "thread").lower()
+        self.slice_window = float(os.getenv("ALERT_SLICE_WINDOW", "3600"))
+        self._slice_pool = None
+        self.summary_interval = float(os.getenv("ALERT_METRICS_SUMMARY", "60"))
+        self.metrics_port = int(os.getenv("ALERT_METRICS_PORT", "0"))
+        self._metrics_server = None
+        REGISTRY.add_collector(self._collect_gauges)
+        checkpoint_file = os.getenv("ALERT_CHECKPOINT_FILE", ".alert_checkpoint_{label}.json")
+        self.targets = [
+            MonitorTarget(label, index, scheduler_factory(), self._new_coalescer(),
+                          CheckpointStore(checkpoint_file.format(label=label.lower())), self.agg_mode)
+            for label, index in targets
+        ]
+
+    @property
+    def es(self):
+        # Một client (một connection pool) dùng chung cho mọi target; tạo lười vì elasticsearch nạp khá nặng
+        # và replay offline không cần tới
+        with self._es_lock:
+            if self._es is None:
+                from elasticsearch import Elasticsearch
+                self._es = Elasticsearch(self.ELASTIC_HOST, basic_auth=self.AUTH, verify_certs=False,
+                                         connections_per_node=max(http_client.setting("HTTP_POOL_SIZE"), 2 * len(self.targets)))
+            return self._es
 
     def _get_current_branch(self):
         try:
             return subprocess.check_output(["git", "rev-parse", "--abbrev-ref", "HEAD"]).decode().strip()
         except Exception:
             return "dev"
-        
-    def send_telegram(self, msg):
-        try:
-            url = f"https://api.telegram.org/bot{self.TOKEN}/sendMessage"
-            payload = {'chat_id': self.CHAT_ID, 'text': msg, 'parse_mode': 'HTML'}
-            requests.post(url, data=payload, timeout=10)
-        except Exception as e:
-            print(f"\n[-] Telegram Error: {e}")
+
+    def _new_coalescer(self):
+        return AlertCoalescer(
+            window=float(os.getenv("ALERT_COALESCE_WINDOW", "60")),
+            thresholds=[int(x) for x in os.getenv("ALERT_RENOTIFY_AT", "10,100,1000,10000").split(",") if x.strip()],
+            clock=self.clock
+        )
+
+    def stats(self):
+        return {t.label: t.snapshot() for t in self.targets}
+
+    def _collect_gauges(self):
+        now = time.time()
+        for t in self.targets:
+            CHECKPOINT_LAG.labels(target=t.label).set(max(0.0, now - parser.isoparse(t.last_checkpoint).timestamp()))
+            lag = t.scheduler.ingest_lag
+            if lag is not None:
+                INGEST_LAG.labels(target=t.label).set(lag)
+            d = t.sent_alerts_cache.stats()
+            DEDUP_SIZE.labels(target=t.label).set(d["size"])
+            DEDUP_LOOKUPS.labels(target=t.label, result="hit").set(d["hits"])
+            DEDUP_LOOKUPS.labels(target=t.label, result="miss").set(d["misses"])
+            DEDUP_EVICTIONS.labels(target=t.label, reason="size").set(d["evicted_size"])
+            DEDUP_EVICTIONS.labels(target=t.label, reason="age").set(d["evicted_age"])
+            p = t.scheduler.stats()
+            POLL_DELAY.labels(target=t.label).set(p["last_delay"])
+            POLL_ERROR_STREAK.labels(target=t.label).set(p["consecutive_errors"])
+            COALESCER_SIZE.labels(target=t.label).set(len(t.coalescer))
+        QUEUE_DEPTH.set(self.notifier.metrics()["depth"])
+
+    def metrics_summary(self):
+        self._collect_gauges()
+        m = self.notifier.metrics()
+
+        def ms(h):
+            v = h.quantile(0.95)
+            return f"{v * 1000:.0f}ms" if v is not None else "-"
+
+        e2e = E2E_SECONDS.quantile(0.95)
+        lags = " ".join(f"{t.label}:{t.scheduler.ingest_lag:.0f}s" for t in self.targets if t.scheduler.ingest_lag is not None)
+        # evicted size > 0: ALERT_DEDUP_SIZE quá nhỏ, ID còn sống bị đẩy ra -> có thể gửi trùng alert
+        dedup = " ".join(f"{t.label}:{d['size']}/{d['capacity']} evicted_size={d['evicted_size']} evicted_age={d['evicted_age']}"
+                         for t, d in ((t, t.sent_alerts_cache.stats()) for t in self.targets))
+        return (f"[*] Metrics: polls={POLLS.total():.0f} hits={HITS.total():.0f} dedup_drops={DEDUP_DROPS.total():.0f} "
+                f"groups={GROUPS.total():.0f} sent={m['sent']} failed={m['failed']} dropped={m['dropped']} queue={m['depth']} | "
+                f"p95 search={ms(SEARCH_SECONDS)} page={ms(PAGE_SECONDS)} telegram={ms(SEND_SECONDS)} "
+                f"e2e={f'{e2e:.1f}s' if e2e is not None else '-'} | lag {lags or '-'} | dedup {dedup or '-'}")
+
+    def _summary_loop(self, log_callback):
+        while self.running:
+            self._sleep(self.summary_interval)
+            if self.running:
+                log_callback(self.metrics_summary())
+
+    def send_telegram(self, msg, event_ts=None, risk=0):
+        return self.notifier.submit(msg, event_ts, risk)
+
+    def deliver(self, target, fingerprint, record, count, first_time, last_time):
+        for rec, total, first, last in target.coalescer.add(fingerprint, record, count, first_time, last_time):
+            self.send_telegram(render_message(target.label, rec, total, last, first), parser.isoparse(last).timestamp(), rec.risk_score)
+
+    def flush_coalesced(self, target, force=False):
+        for record, count, first_time, last_time in target.coalescer.flush(force=force):
+            self.send_telegram(render_message(target.label, record, count, last_time, first_time), parser.isoparse(last_time).timestamp(),
+                               record.risk_score)
 
     def run_logic(self, log_callback):
         log_callback(f"[*] SOC MONITORING ACTIVE: {self.ENV_LABEL}")
-        
+        if self.agg_mode == "server":
+            log_callback("[*] Aggregation mode: server-side (composite fingerprint buckets)")
+        self.notifier.log_func = log_callback
+        self.notifier.start()
+        if self.metrics_port and self._metrics_server is None:
+            self._metrics_server = start_http_server(self.metrics_port)
+            log_callback(f"[*] Prometheus metrics on http://127.0.0.1:{self.metrics_port}/metrics")
+        if self.summary_interval > 0:
+            threading.Thread(target=self._summary_loop, args=(log_callback,), daemon=True).start()
+        try:
+            with ThreadPoolExecutor(max_workers=len(self.targets), thread_name_prefix="alert-poll") as pool:
+                for f in [pool.submit(self._poll_loop, t, log_callback) for t in self.targets]:
+                    f.result()
+        finally:
+            for t in self.targets:
+                self.flush_coalesced(t, force=True)
+                try:
+                    t.save_state()
+                except OSError as e:
+                    log_callback(f"[-] [{t.label}] Checkpoint save failed: {e}")
+                s = t.snapshot()
+                log_callback(f"[*] [{t.label}] polls={s['polls']} hits={s['hits']} groups={s['groups']} errors={s['errors']}")
+            if self._slice_pool:
+                self._slice_pool.shutdown(wait=False)
+                self._slice_pool = None
+            self.notifier.stop()
+            m = self.notifier.metrics()
+            log_callback(f"[*] Alert delivery: sent={m['sent']} failed={m['failed']} dropped={m['dropped']} spilled={m.get('spilled', 0)} pending={m['depth']}")
+
+    def process_page(self, target, hits):
+        aggregated_alerts = {}
+        new_ids = []
+        start = time.perf_counter()
+        dropped = 0
+        for hit in hits:
+            alert_id = hit['_id']
+            if alert_id in target.sent_alerts_cache:
+                dropped += 1
+                continue
+            record = AlertRecord.from_hit(hit)
+            new_ids.append((alert_id, record.sort[0]))
+            group = aggregated_alerts.get(record.fingerprint)
+            if group is None:
+                aggregated_alerts[record.fingerprint] = [record, 1, record.timestamp, record.timestamp]
+            else:
+                group[1] += 1
+                group[3] = record.timestamp
+
+        for fp, (record, count, first_time, last_time) in aggregated_alerts.items():
+            self.deliver(target, fp, record, count, first_time, last_time)
+        # Thêm theo thứ tự hit (tăng dần @timestamp) để DedupIndex evict đúng thứ tự thời gian
+        for aid, event_ms in new_ids:
+            target.sent_alerts_cache.add(aid, event_ms)
+        target.stats["groups"] += len(aggregated_alerts)
+        DEDUP_DROPS.labels(target=target.label).inc(dropped)
+        GROUPS.labels(target=target.label).inc(len(aggregated_alerts))
+        PAGE_SECONDS.labels(target=target.label).observe(time.perf_counter() - start)
+        return len(aggregated_alerts)
+
+    def ingest_page(self, target, hits):
+        # Xử lý 1 page hit (tăng dần @timestamp) và dời checkpoint; dùng chung cho poll thật và replay offline
+        target.stats["hits"] += len(hits)
+        HITS.labels(target=target.label).inc(len(hits))
+        self.process_page(target, hits)
+        last_hit_dt = parser.isoparse(hits[-1]['_source']['@timestamp'])
+        safety_checkpoint = last_hit_dt - timedelta(seconds=15)
+        target.last_checkpoint = safety_checkpoint.isoformat().replace("+00:00", "Z")
+        target.sent_alerts_cache.evict_before(safety_checkpoint.timestamp() * 1000)
+        target.last_sort_value = hits[-1]['sort']
+        return last_hit_dt
+
+    def _poll_loop(self, target, log_callback):
+        if target.catching_up:
+            log_callback(f"[*] [{target.label}] Catch-up mode: draining alerts since {target.last_checkpoint}")
         while self.running:
             try:
-                query = {
-                    "size": 1000,
-                    "query": {
-                        "bool": {
-                            "must": [
-                                {
-                                    "range": {
-                                        "@timestamp": {
-                                            "gt": self.last_checkpoint
-                                        }
-                                    }
-                                }
-                            ]
-                        }
-                    },
-                    "sort": [
-                        {"@timestamp": {"order": "asc"}},
-                        {"_doc": {"order": "asc"}}
-                    ]
-                }
-                if self.last_sort_value:
-                    query["search_after"] = self.last_sort_value
-
-                res = self.es.search(index=self.INDEX, body=query)
-                hits = res['hits']['hits']
-
-                if hits:
-                    aggregated_alerts = {}
-
-                    for hit in hits:
-                        alert_id = hit['_id']
-                        if alert_id in self.sent_alerts_cache:
-                            continue
-                            
-                        _src = hit['_source']
-                        timestamp = _src['@timestamp']
-                        
-                        rule_name = _src.get('kibana.alert.rule.name') or "Security Alert"
-                        user_name = _src.get('user', {}).get('name') or \
-                                    _src.get('winlog', {}).get('user', {}).get('name') or "Unknown"
-                        
-                        evidence = _src.get('powershell', {}).get('file', {}).get('script_block_text') or \
-                                   _src.get('process', {}).get('command_line') or \
-                                   _src.get('source', {}).get('ip') or \
-                                   _src.get('host', {}).get('ip') or "N/A"
-
-                        proc_name = _src.get('process', {}).get('name') or "N/A"
-                        fingerprint = f"{rule_name}|{user_name}|{evidence}"
-
-                        if fingerprint not in aggregated_alerts:
-                            aggregated_alerts[fingerprint] = {
-                                "source": _src,
-                                "count": 1,
-                                "last_time": timestamp,
-                                "evidence": evidence,
-                                "proc_name": proc_name,
-                                "user": user_name,
-                                "rule": rule_name,
-                                "ids": [alert_id]
-                            }
-                        else:
-                            aggregated_alerts[fingerprint]["count"] += 1
-                            aggregated_alerts[fingerprint]["last_time"] = timestamp
-                            aggregated_alerts[fingerprint]["ids"].append(alert_id)
-                    
-                    for fp, alert in aggregated_alerts.items():
-                        _s = alert["source"]
-                        count = alert["count"]
-                        risk_score = _s.get('kibana.alert.rule.risk_score') or 0
-                        pp_name = _s.get('process', {}).get('parent', {}).get('name') or "N/A"
-
-                        icon = "🔴" if risk_score >= 70 else "🟡" if risk_score >= 40 else "🔵"
-
-                        local_time = parser.isoparse(alert["last_time"]).astimezone(tz.tzlocal()).strftime('%H:%M:%S')
-
-                        attempt_str = f" (x{count})" if count > 1 else ""
-
-                        msg = (f"{icon} <b>{self.ENV_LABEL} RISK ALERT{attempt_str}</b>\n"
-                               f"Risk Score: <code>{risk_score}</code>\n"
-                               f"━━━━━━━━━━━━━━━━━━━━━\n"
-                               f"- Time: <code>{local_time}</code> | User: <code>{alert['user']}</code>\n"
-                               f"- Rule: <i>{alert['rule']}</i>\n"
-                               f"─────────────────────\n"
-                               f"- Parent: <code>{pp_name.upper()}</code>\n"
-                               f"- Process: <code>{alert['proc_name'].upper()}</code>\n"
-                               f"- Evidence:\n<code>{str(alert['evidence']).strip()[:500]}</code>\n"
-                               f"━━━━━━━━━━━━━━━━━━━━━")
-
-                        self.send_telegram(msg)
-                        for aid in alert["ids"]:
-                            self.sent_alerts_cache.append(aid)
-                    last_hit_ts_str = hits[-1]['_source']['@timestamp']
-                    last_hit_dt = parser.isoparse(last_hit_ts_str)
-                    safety_checkpoint = last_hit_dt - timedelta(seconds=15)
-                    self.last_checkpoint = safety_checkpoint.isoformat().replace("+00:00", "Z")
-                    self.last_sort_value = hits[-1]['sort']
-
-                    if len(hits) < 1000:
-                        time.sleep(5)
+                self.flush_coalesced(target)
+                target.stats["polls"] += 1
+                POLLS.labels(target=target.label).inc()
+                if self.agg_mode == "server":
+                    delay = self._poll_aggregated(target, log_callback)
+                elif self.slices > 1 and target.catching_up:
+                    delay = self._poll_sliced(target, log_callback)
                 else:
-                    time.sleep(5)
-
+                    delay = self._poll_hits(target, log_callback)
             except Exception as e:
-                log_callback(f"[-] Error: {e}")
-                time.sleep(5)
\ No newline at end of file
+                target.stats["errors"] += 1
+                POLL_ERRORS.labels(target=target.label).inc()
+                delay = target.scheduler.on_error()
+                log_callback(f"[-] [{target.label}] Error: {e} (retry in {delay:.1f}s)")
+            self._sleep(delay)
+
+    def _sleep(self, delay):
+        # Ngủ theo lát nhỏ để tắt THREAT SCAN có hiệu lực ngay cả khi đang backoff dài
+        deadline = time.monotonic() + delay
+        while self.running and time.monotonic() < deadline:
+            time.sleep(min(0.5, deadline - time.monotonic()))
+
+    def _search(self, target, body):
+        start = time.perf_counter()
+        try:
+            return self.es.search(index=target.index, body=body)
+        finally:
+            elapsed = time.perf_counter() - start
+            target.stats["search_ms"] += elapsed * 1000
+            SEARCH_SECONDS.labels(target=target.label).observe(elapsed)
+
+    def _finish_catch_up(self, target, log_callback):
+        if target.catching_up:
+            target.catching_up = False
+            lag = target.scheduler.ingest_lag
+            log_callback(f"[+] [{target.label}] Catch-up complete, live at {target.last_checkpoint}" + (f" (ingest lag {lag:.1f}s)" if lag is not None else ""))
+
+    def _poll_hits(self, target, log_callback):
+        query = build_poll_query(target.last_checkpoint, target.last_sort_value)
+        res = self._search(target, query)
+        hits = res['hits']['hits']
+        if not hits:
+            self._finish_catch_up(target, log_callback)
+            return target.scheduler.on_idle()
+
+        last_hit_dt = self.ingest_page(target, hits)
+        target.save_state()
+        if self.slices > 1 and len(hits) >= PAGE_SIZE and not target.catching_up:
+            # Page đầy = đang tụt lại phía sau -> chuyển sang catch-up song song
+            target.catching_up = True
+            log_callback(f"[*] [{target.label}] Backlog detected, switching to sliced catch-up ({self.slices} slices)")
+
+        # Catch-up: không ngủ giữa các page cho tới khi query trả về rỗng (đã theo kịp real-time)
+        return target.scheduler.on_page(len(hits), PAGE_SIZE, last_hit_dt.timestamp(), backlog=target.catching_up)
+
+    def _run_slices(self, target, pit_id, start, end):
+        if self.slice_workers == "process":
+            if self._slice_pool is None:
+                self._slice_pool = ProcessPoolExecutor(self.slices, initializer=_init_slice_worker,
+                                                       initargs=(self.ELASTIC_HOST, self.AUTH))
+            seen = frozenset(aid for aid, _ in target.sent_alerts_cache.snapshot())
+            futures = [self._slice_pool.submit(consume_slice, pit_id, i, self.slices, start, end, seen)
+                       for i in range(self.slices)]
+            return [f.result() for f in futures]
+        # Thread: các slice chỉ đọc dedup index, chỉ ghi vào sau khi merge
+        with ThreadPoolExecutor(max_workers=self.slices, thread_name_prefix=f"slice-{target.label}") as pool:
+            futures = [pool.submit(consume_slice, pit_id, i, self.slices, start, end, target.sent_alerts_cache, self.es)
+                       for i in range(self.slices)]
+            return [f.result() for f in futures]
+
+    def _poll_sliced(self, target, log_callback):
+        # Cửa sổ (checkpoint, min(now - 15s, checkpoint + ALERT_SLICE_WINDOW)] đọc song song theo slice trong 1 PIT.
+        # Slice nào lỗi thì cả cửa sổ lỗi -> checkpoint chỉ tiến khi mọi slice đã xong.
+        start_dt = parser.isoparse(target.last_checkpoint)
+        live_end = datetime.now(timezone.utc) - timedelta(seconds=15)
+        end_dt = min(live_end, start_dt + timedelta(seconds=self.slice_window))
+        if end_dt <= start_dt:
+            self._finish_catch_up(target, log_callback)
+            return target.scheduler.on_idle()
+        start, end = target.last_checkpoint, end_dt.isoformat().replace("+00:00", "Z")
+
+        pit_id = self.es.open_point_in_time(index=target.index, keep_alive="2m")['id']
+        try:
+            parts = self._run_slices(target, pit_id, start, end)
+        finally:
+            try:
+                self.es.close_point_in_time(id=pit_id)
+            except Exception:
+                pass
+
+        t0 = time.perf_counter()
+        merged, new_ids, total, dropped = merge_slices(parts)
+        for fp, (record, count, first_time, last_time, _, _) in sorted(merged.items(), key=lambda kv: kv[1][4]):
+            self.deliver(target, fp, record, count, first_time, last_time)
+        for aid, event_ms in new_ids:
+            target.sent_alerts_cache.add(aid, event_ms)
+        target.sent_alerts_cache.evict_before((end_dt - timedelta(seconds=15)).timestamp() * 1000)
+        target.stats["hits"] += total
+        target.stats["groups"] += len(merged)
+        target.stats["search_ms"] += sum(p[4] for p in parts) * 1000
+        HITS.labels(target=target.label).inc(total)
+        DEDUP_DROPS.labels(target=target.label).inc(dropped)
+        GROUPS.labels(target=target.label).inc(len(merged))
+        PAGE_SECONDS.labels(target=target.label).observe(time.perf_counter() - t0)
+        SLICED_WINDOWS.labels(target=target.label).inc()
+
+        target.last_checkpoint = end
+        target.last_sort_value = None
+        target.save_state()
+        last_event = max((g[5] for g in merged.values()), default=None)
+        last_event = last_event / 1000 if last_event else None
+        if end_dt < live_end:
+            return target.scheduler.on_page(0, PAGE_SIZE, last_event, backlog=True)
+        self._finish_catch_up(target, log_callback)
+        return target.scheduler.on_idle(last_event)
+
+    def _poll_aggregated(self, target, log_callback):
+        # Cửa sổ (checkpoint, now - 15s]: lùi 15s để alert index trễ vẫn rơi vào cửa sổ sau,
+        # các cửa sổ không chồng nhau nên không cần dedup theo ID.
+        # after_key được commit theo từng page: lỗi giữa chừng thì lần poll sau đọc tiếp đúng cửa sổ đó
+        # từ page kế tiếp, không giao lại (đếm trùng trong coalescer) các bucket đã giao.
+        cursor = target.agg_cursor
+        if cursor:
+            end_str, after_key = cursor["end"], cursor.get("after")
+        else:
+            window_end = datetime.now(timezone.utc) - timedelta(seconds=15)
+            if window_end <= parser.isoparse(target.last_checkpoint):
+                return target.scheduler.on_idle()
+            end_str, after_key = window_end.isoformat().replace("+00:00", "Z"), None
+        last_event_ms = None
+        while True:
+            res = self._search(target, build_aggregation_query(target.last_checkpoint, end_str, after_key))
+            agg = res['aggregations']['fingerprints']
+            for bucket in agg['buckets']:
+                record = AlertRecord.from_hit(bucket['latest']['hits']['hits'][0])
+                self.deliver(target, record.fingerprint, record, bucket['doc_count'],
+                             bucket['first_seen']['value_as_string'], bucket['last_seen']['value_as_string'])
+                target.stats["hits"] += bucket['doc_count']
+                target.stats["groups"] += 1
+                HITS.labels(target=target.label).inc(bucket['doc_count'])
+                GROUPS.labels(target=target.label).inc()
+                last_event_ms = max(last_event_ms or 0, bucket['last_seen']['value'])
+            after_key = agg.get('after_key')
+            if not agg['buckets'] or not after_key:
+                break
+            target.agg_cursor = {"end": end_str, "after": after_key}
+            target.save_state()
+
+        target.agg_cursor = None
+        target.last_checkpoint = end_str
+        target.last_sort_value = None
+        target.save_state()
+        self._finish_catch_up(target, log_callback)
+        return target.scheduler.on_idle(last_event_ms / 1000 if last_event_ms else None)
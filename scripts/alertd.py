@@ -0,0 +1,44 @@
+import argparse
+import os
+import signal
+import sys
+from datetime import datetime
+
+# Daemon chạy alert pipeline không cần GUI (Linux collector / systemd service).
+# Không import customtkinter/tkinter/winsound/psutil; các module nặng chỉ nạp trong main().
+
+
+def log(msg):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] > {msg}", flush=True)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Headless SIEM alert monitor (Elasticsearch -> Telegram)")
+    ap.add_argument("--targets", help="LABEL=index[,LABEL=index...] (mặc định: ALERT_TARGETS hoặc theo nhánh git)")
+    ap.add_argument("--agg-mode", choices=["client", "server"], help="ghi đè ALERT_AGG_MODE")
+    ap.add_argument("--checkpoint-file", help="ghi đè ALERT_CHECKPOINT_FILE (hỗ trợ {label})")
+    args = ap.parse_args(argv)
+
+    if args.targets: os.environ["ALERT_TARGETS"] = args.targets
+    if args.agg_mode: os.environ["ALERT_AGG_MODE"] = args.agg_mode
+    if args.checkpoint_file: os.environ["ALERT_CHECKPOINT_FILE"] = args.checkpoint_file
+
+    from alert import AlertMonitor
+    monitor = AlertMonitor()
+
+    def _shutdown(signum, _frame):
+        # run_logic tự flush coalescer + checkpoint + hàng đợi Telegram khi vòng poll dừng
+        log(f"[*] Received {signal.Signals(signum).name}, flushing checkpoint and stopping...")
+        monitor.running = False
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+
+    monitor.running = True
+    monitor.run_logic(log)
+    log("[*] Alert daemon stopped.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import http_client
+import sigma_engine
+
+AUDIT_FIELDS = ("rule_id", "name", "enabled", "query", "interval")
+COMPARED = ("enabled", "query", "interval")
+PAGE_SIZE = int(os.getenv("AUDIT_PAGE_SIZE", "1000"))
+AUDIT_WORKERS = int(os.getenv("AUDIT_WORKERS", "8"))
+MAX_WINDOW = 10000          # _find không cho page * per_page vượt 10k -> chia nhỏ theo rule_id
+EXPECTED_INTERVAL = "1m"    # deploy.py patch interval cho mọi rule
+HEX = "0123456789abcdef"
+
+
+def content_hash(rule):
+    return hashlib.sha1(json.dumps([rule.get(f) for f in COMPARED]).encode()).hexdigest()
+
+
+def _get_page(session, url, page, flt=None):
+    params = {"page": page, "per_page": PAGE_SIZE, "fields": list(AUDIT_FIELDS),
+              "sort_field": "created_at", "sort_order": "asc"}
+    if flt:
+        params["filter"] = flt
+    res = session.get(url, params=params)
+    res.raise_for_status()
+    return res.json()
+
+
+def _split(prefix):
+    # 16 nhóm con theo ký tự kế tiếp của rule_id + 1 nhóm "còn lại" (rule_id không phải hex ở vị trí đó)
+    field = "alert.attributes.params.ruleId"
+    hexes = [f"{field}: {prefix}{c}*" for c in HEX]
+    rest = f"not ({' or '.join(hexes)})"
+    return [(prefix + c, flt) for c, flt in zip(HEX, hexes)] + \
+        [((prefix, "rest"), f"{field}: {prefix}* and {rest}" if prefix else rest)]
+
+
+def _head(session, url, bucket):
+    try:
+        return _get_page(session, url, 1, bucket[1])
+    except requests.RequestException as e:
+        return e
+
+
+def fetch_kibana(session, base, workers=AUDIT_WORKERS):
+    # Trang 1 cho biết total, các trang còn lại lấy song song. Nhóm nào > 10k rule (giới hạn cửa sổ của _find)
+    # thì chia tiếp theo ký tự kế của rule_id. Nhóm lỗi được ghi vào failed, các nhóm khác vẫn dùng được.
+    url = f"{base}/_find"
+    first = _get_page(session, url, 1)
+    total = first.get("total", 0)
+    ok, failed = [], []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        level = [("", None)]
+        heads = [first]
+        while level:
+            split = []
+            for bucket, head in zip(level, heads):
+                if isinstance(head, Exception):
+                    failed.append({"bucket": bucket[0], "filter": bucket[1], "error": str(head)})
+                elif head.get("total", 0) <= MAX_WINDOW:
+                    ok.append((bucket, head))
+                elif isinstance(bucket[0], str) and len(bucket[0]) < 32:
+                    split += _split(bucket[0])
+                else:
+                    failed.append({"bucket": bucket[0], "filter": bucket[1],
+                                   "error": f"{head['total']} rules, over the {MAX_WINDOW} result window"})
+            level = split
+            heads = list(pool.map(lambda b: _head(session, url, b), level))
+
+        jobs = [(bucket, page) for bucket, head in ok for page in range(2, -(-head.get("total", 0) // PAGE_SIZE) + 1)]
+
+        def fetch(job):
+            try:
+                return job[0], _get_page(session, url, job[1], job[0][1])
+            except requests.RequestException as e:
+                return job[0], e
+        pages = [(bucket, head) for bucket, head in ok] + list(pool.map(fetch, jobs))
+
+    # 1 trang lỗi = cả nhóm không đầy đủ
+    broken = {}
+    for bucket, page in pages:
+        if isinstance(page, Exception) and bucket[0] not in broken:
+            broken[bucket[0]] = {"bucket": bucket[0], "filter": bucket[1], "error": str(page)}
+    failed += broken.values()
+    rules = {}
+    for bucket, page in pages:
+        if bucket[0] in broken:
+            continue
+        for r in page.get("data", []):
+            rules[r.get("rule_id")] = r
+    return rules, total, failed
+
+
+def in_failed(rid, failed):
+    # rule_id thuộc nhóm không lấy được -> không kết luận được là thiếu trên Kibana
+    for f in failed:
+        b = f["bucket"]
+        if isinstance(b, str) and rid.startswith(b):
+            return True
+        if not isinstance(b, str) and rid.startswith(b[0]) and (len(rid) <= len(b[0]) or rid[len(b[0])] not in HEX):
+            return True
+    return False
+
+
+def repo_expectations(catalog, cache_dir, log_func=print):
+    # Trạng thái mong muốn lấy từ catalog (không parse lại YAML) + cache convert theo hash của deploy.py
+    with catalog.lock:
+        entries = {p: e for p, e in catalog.entries.items() if e["id"] and e["title"] is not None}
+    cache = sigma_engine.load_cache(cache_dir)
+    missing = [p for p, e in entries.items() if e["hash"] not in cache]
+    if missing and sigma_engine.available():
+        log_func(f"[*] Converting {len(missing)} rules chưa có trong cache...")
+        for res in sigma_engine.convert_files(missing):
+            if res["status"] != "failed":
+                cache[entries[res["path"]]["hash"]] = "\n".join(res["lines"]) or None
+        try:
+            sigma_engine.save_cache(cache_dir, cache, {e["hash"] for e in entries.values()})
+        except OSError:
+            pass
+    repo = {}
+    for p, e in entries.items():
+        line = cache.get(e["hash"])
+        repo[str(e["id"])] = {
+            "path": p, "enabled": e["status"] != 'deprecated', "interval": EXPECTED_INTERVAL,
+            # query None = không so được (chưa convert / không có pySigma / rule unsupported)
+            "query": json.loads(line.rsplit("\n", 1)[-1]).get("query") if line else None,
+            "deployable": line is not None or e["hash"] not in cache,
+        }
+    return repo
+
+
+def diff(repo, kibana, failed=()):
+    report = {"repo": len(repo), "kibana": len(kibana), "in_sync": 0,
+              "only_in_repo": [], "only_in_kibana": [], "changed": [], "not_deployable": [], "unverified": []}
+    for rid, want in repo.items():
+        have = kibana.get(rid)
+        name = os.path.basename(want["path"])
+        if have is None and failed and in_failed(rid, failed):
+            report["unverified"].append({"rule_id": rid, "file": name})
+            continue
+        if have is None:
+            report["only_in_repo" if want["deployable"] else "not_deployable"].append({"rule_id": rid, "file": name})
+            continue
+        if want["query"] is None:
+            have = dict(have, query=None)
+        if content_hash(want) == content_hash(have):
+            report["in_sync"] += 1
+            continue
+        fields = [f for f in COMPARED if want.get(f) != have.get(f)]
+        report["changed"].append({"rule_id": rid, "file": name, "fields": fields,
+                                  "repo": {f: want.get(f) for f in fields}, "kibana": {f: have.get(f) for f in fields}})
+    report["only_in_kibana"] = [{"rule_id": rid, "name": r.get("name")} for rid, r in kibana.items() if rid not in repo]
+    return report
+
+
+def run_audit(base, catalog, auth, cache_dir, log_func=print):
+    t0 = time.perf_counter()
+    session = http_client.kibana(base, auth, pool_size=AUDIT_WORKERS)
+    with ThreadPoolExecutor(max_workers=1) as side:
+        # Convert/đọc cache phía repo chạy song song với việc kéo dữ liệu từ Kibana
+        repo_future = side.submit(repo_expectations, catalog, cache_dir, log_func)
+        kibana, total, failed = fetch_kibana(session, base)
+        repo = repo_future.result()
+    report = diff(repo, kibana, failed)
+    report["kibana_total"] = total
+    report["incomplete"] = [{"bucket": f["bucket"] if isinstance(f["bucket"], str) else f"{f['bucket'][0]}<rest>",
+                             "filter": f["filter"], "error": f["error"]} for f in failed]
+    report["seconds"] = round(time.perf_counter() - t0, 2)
+    return report
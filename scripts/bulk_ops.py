@@ -0,0 +1,58 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+CHUNK_SIZE = 100
+ABSENT = "absent"  # 404: Kibana không có rule này (chưa từng deploy, hoặc đã bị xóa từ trước)
+
+
+class BulkDelete:
+    # Gửi _bulk_delete theo lô song song, ghi journal sau mỗi lô để thao tác bị ngắt có thể chạy tiếp.
+    # state (journal): pending {rule_id: path} chưa xóa được, done {rule_id: path} đã xóa, absent {rule_id: path} Kibana trả 404,
+    # failed {rule_id: lỗi gần nhất}
+    def __init__(self, session, url, journal, chunk_size=CHUNK_SIZE, workers=4):
+        self.session = session
+        self.url = url
+        self.journal = journal
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self._lock = threading.Lock()
+
+    def _send(self, ids):
+        # Trả về {rule_id: None nếu đã xóa, ABSENT nếu 404, hoặc thông báo lỗi}
+        try:
+            res = self.session.post(self.url, json=[{"rule_id": rid} for rid in ids])
+        except Exception as e:
+            return {rid: f"Connection failed: {e}" for rid in ids}
+        if res.status_code != 200:
+            return {rid: f"HTTP {res.status_code}: {res.text[:200]}" for rid in ids}
+        results = {rid: "missing from response" for rid in ids}
+        for item in res.json():
+            err = item.get('error')
+            if not err:
+                results[item.get('rule_id')] = None
+            elif err.get('status_code') == 404:
+                # Không biết chắc ai xóa -> ghi riêng, caller quyết định xử lý file
+                results[item.get('rule_id')] = ABSENT
+            else:
+                results[item.get('rule_id')] = err.get('message', str(err))
+        return results
+
+    def run(self, state):
+        ids = list(state["pending"])
+        chunks = [ids[i:i + self.chunk_size] for i in range(0, len(ids), self.chunk_size)]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for fut in as_completed([pool.submit(self._send, c) for c in chunks]):
+                with self._lock:
+                    for rid, err in fut.result().items():
+                        if rid not in state["pending"]:
+                            continue
+                        if err is None:
+                            state["done"][rid] = state["pending"].pop(rid)
+                            state["failed"].pop(rid, None)
+                        elif err == ABSENT:
+                            state.setdefault("absent", {})[rid] = state["pending"].pop(rid)
+                            state["failed"].pop(rid, None)
+                        else:
+                            state["failed"][rid] = err
+                    self.journal.save(state)
+        return state
@@ -0,0 +1,34 @@
+import json
+import os
+import tempfile
+
+
+class CheckpointStore:
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"[-] Checkpoint unreadable ({self.path}): {e}")
+            return None
+
+    def save(self, state):
+        # Ghi ra file tạm cùng thư mục rồi os.replace -> không bao giờ để lại checkpoint ghi dở
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix=".ckpt-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            try: os.remove(tmp)
+            except OSError: pass
+            raise
@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Entry:
+    __slots__ = ("record", "count", "first_time", "last_time", "notified", "opened_at", "next_threshold")
+
+    def __init__(self, record, count, first_time, last_time, opened_at):
+        self.record = record
+        self.count = count
+        self.first_time = first_time
+        self.last_time = last_time
+        self.notified = count
+        self.opened_at = opened_at
+        self.next_threshold = 0
+
+
+class AlertCoalescer:
+    # Giữ mỗi fingerprint "mở" trong `window` giây: lần đầu gửi ngay, các lần sau chỉ cộng dồn,
+    # gửi lại khi vượt ngưỡng (x10, x100...) và gửi 1 bản tổng kết khi đóng cửa sổ.
+    def __init__(self, window=60, thresholds=(10, 100, 1000, 10000), max_entries=5000, clock=time.time):
+        self.window = window
+        self.thresholds = sorted(thresholds)
+        self.max_entries = max_entries
+        self.clock = clock
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"merged": 0, "emitted": 0, "evicted": 0}
+
+    def __len__(self):
+        return len(self._open)
+
+    def add(self, fingerprint, record, count, first_time, last_time, now=None):
+        if self.window <= 0:
+            self.stats["emitted"] += 1
+            return [(record, count, first_time, last_time)]
+        now = self.clock() if now is None else now
+        out = []
+        with self._lock:
+            entry = self._open.get(fingerprint)
+            if entry is None:
+                entry = _Entry(record, count, first_time, last_time, now)
+                self._skip_thresholds(entry)
+                self._open[fingerprint] = entry
+                out.append((record, count, first_time, last_time))
+                while len(self._open) > self.max_entries:
+                    _, old = self._open.popitem(last=False)
+                    self.stats["evicted"] += 1
+                    self._emit_pending(old, out)
+            else:
+                entry.record = record
+                entry.count += count
+                entry.last_time = last_time
+                self._open.move_to_end(fingerprint)
+                self.stats["merged"] += 1
+                if entry.next_threshold < len(self.thresholds) and entry.count >= self.thresholds[entry.next_threshold]:
+                    self._skip_thresholds(entry)
+                    self._emit_pending(entry, out)
+            self.stats["emitted"] += len(out)
+        return out
+
+    def flush(self, now=None, force=False):
+        now = self.clock() if now is None else now
+        out = []
+        with self._lock:
+            for fp in [fp for fp, e in self._open.items() if force or now - e.opened_at >= self.window]:
+                self._emit_pending(self._open.pop(fp), out)
+            self.stats["emitted"] += len(out)
+        return out
+
+    def _skip_thresholds(self, entry):
+        while entry.next_threshold < len(self.thresholds) and entry.count >= self.thresholds[entry.next_threshold]:
+            entry.next_threshold += 1
+
+    def _emit_pending(self, entry, out):
+        if entry.count > entry.notified:
+            entry.notified = entry.count
+            out.append((entry.record, entry.count, entry.first_time, entry.last_time))
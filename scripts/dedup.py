@@ -0,0 +1,50 @@
+from collections import OrderedDict
+
+
+class DedupIndex:
+    # Hash lookup O(1) + thứ tự chèn (tăng dần theo @timestamp vì query sort asc) để evict từ đầu
+    def __init__(self, max_size=50000):
+        self.max_size = max_size
+        self._seen = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evicted_size = 0
+        self.evicted_age = 0
+
+    def __len__(self):
+        return len(self._seen)
+
+    def __contains__(self, alert_id):
+        if alert_id in self._seen:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, alert_id, ts_ms):
+        if alert_id in self._seen:
+            return
+        self._seen[alert_id] = ts_ms
+        while len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+            self.evicted_size += 1
+
+    def evict_before(self, cutoff_ms):
+        # Alert có @timestamp <= checkpoint không thể quay lại trong query "gt checkpoint" -> bỏ an toàn
+        while self._seen:
+            ts = next(iter(self._seen.values()))
+            if ts > cutoff_ms:
+                break
+            self._seen.popitem(last=False)
+            self.evicted_age += 1
+
+    def snapshot(self):
+        return [[aid, ts] for aid, ts in self._seen.items()]
+
+    def restore(self, items):
+        for aid, ts in items:
+            self.add(aid, ts)
+
+    def stats(self):
+        return {"size": len(self._seen), "capacity": self.max_size, "hits": self.hits, "misses": self.misses,
+                "evicted_size": self.evicted_size, "evicted_age": self.evicted_age}
@@ -1,4 +1,9 @@
-import subprocess, requests, sys, io, os, shutil, yaml, json
+import subprocess, sys, io, os, shutil, json, tempfile, time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from rule_scan import scan_rules
+import sigma_engine
+import http_client
+from checkpoint import CheckpointStore
 
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
@@ -11,6 +16,16 @@ SPACE_ID = os.getenv('KIBANA_SPACE')
 RULES_INPUT = 'rules/'
 NDJSON_OUTPUT = 'rules/windows_rules.ndjson'
 
+# Deploy tăng dần: cache kết quả convert theo hash nội dung + trạng thái đã deploy theo space (CI giữ qua actions/cache)
+CACHE_DIR = os.getenv('DEPLOY_CACHE_DIR', '.deploy_cache')
+DEPLOY_MODE = os.getenv('DEPLOY_MODE', 'incremental')  # "full": convert + import lại toàn bộ như trước
+SIGMA_ENGINE = os.getenv('SIGMA_ENGINE', 'auto')  # "auto": pySigma trong process nếu có, "cli": luôn gọi sigma CLI
+SIGMA_WORKERS = int(os.getenv('SIGMA_WORKERS', '0')) or None
+IMPORT_CHUNK_BYTES = int(os.getenv('IMPORT_CHUNK_BYTES', str(2 * 1024 * 1024)))
+IMPORT_CHUNK_RULES = int(os.getenv('IMPORT_CHUNK_RULES', '500'))
+IMPORT_WORKERS = int(os.getenv('IMPORT_WORKERS', '4'))
+IMPORT_RETRIES = int(os.getenv('IMPORT_RETRIES', '3'))
+
 def get_sigma_path():
     sigma_path = shutil.which("sigma")
     if sigma_path: return f'"{sigma_path}"'
@@ -19,22 +34,112 @@ def get_sigma_path():
 
 def process_rules():
     print("[*] Processing rules and metadata...")
-    deprecated_ids = []
-    for root, _, files in os.walk(RULES_INPUT):
-        for file in files:
-            if not file.endswith(('.yml', '.yaml')): continue   
-            path = os.path.join(root, file)
-            try:
-                with open(path, 'r', encoding='utf-8') as f:
-                    data = yaml.safe_load(f)
-                if not data: continue
-                if str(data.get('status', '')).lower() == 'deprecated':
-                    deprecated_ids.append(data.get('id'))
-                    print(f"  [-] Target OFF (deprecated): {file}")
-                        
-            except Exception as e:
-                print(f"  [-] Error {file}: {e}")
-    return deprecated_ids
+    rules, deprecated_ids = [], []
+    for info in scan_rules(RULES_INPUT):
+        file = os.path.basename(info["path"])
+        if info["error"]:
+            print(f"  [-] Error {file}: {info['error']}")
+            continue
+        if info["title"] is None: continue
+        rules.append(info)
+        if info["status"] == 'deprecated':
+            deprecated_ids.append(info["id"])
+            print(f"  [-] Target OFF (deprecated): {file}")
+    return rules, deprecated_ids
+
+def sigma_convert(src, out):
+    cmd = f'{get_sigma_path()} convert -t lucene -p ecs_windows -f siem_rule_ndjson "{src}" --skip-unsupported -o "{out}"'
+    return subprocess.run(cmd, shell=True, capture_output=True).returncode == 0
+
+def convert_cli(todo):
+    # Fallback khi không có pySigma: 1 lần gọi CLI cho cả lô, map dòng output về file qua rule_id
+    tmp = tempfile.mkdtemp(prefix="sigma-")
+    try:
+        src, out = os.path.join(tmp, "rules"), os.path.join(tmp, "out.ndjson")
+        os.makedirs(src)
+        for i, r in enumerate(todo):
+            shutil.copy(r["path"], os.path.join(src, f"{i}_{os.path.basename(r['path'])}"))
+        if not sigma_convert(src, out): return None, []
+        results = {r["path"]: {"path": r["path"], "status": "skipped", "lines": [], "error": None, "seconds": None} for r in todo}
+        by_id = {str(r["id"]): results[r["path"]] for r in todo if r["id"]}
+        loose = []
+        if os.path.exists(out):
+            with open(out, encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip(): continue
+                    res = by_id.get(json.loads(line).get('rule_id'))
+                    if res: res["lines"].append(line.strip()); res["status"] = "ok"
+                    else: loose.append(line.strip())
+        return results, loose
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def convert_engine(todo):
+    results, t0 = {}, time.perf_counter()
+    for res in sigma_engine.convert_files([r["path"] for r in todo], SIGMA_WORKERS):
+        results[res["path"]] = res
+    print(f"[*] In-process conversion: {len(todo)} rules in {time.perf_counter() - t0:.2f}s")
+    # Rule không có id: Sigma tự sinh rule_id, không map được về file -> không cache, luôn import
+    loose = [l for r in todo if not r["id"] for l in results[r["path"]]["lines"]]
+    return results, loose
+
+def report_conversion(results):
+    counts = {"ok": 0, "skipped": 0, "failed": 0}
+    for res in results.values():
+        counts[res["status"]] += 1
+        if res["status"] != "ok":
+            print(f"  [-] {res['status'].upper()} {os.path.basename(res['path'])}: {res['error']}")
+    timed = sorted((r for r in results.values() if r["seconds"] is not None), key=lambda r: -r["seconds"])
+    print(f"[*] Conversion: {counts['ok']} ok, {counts['skipped']} skipped, {counts['failed']} failed")
+    for res in timed[:5]:
+        print(f"  [~] {res['seconds'] * 1000:.0f} ms {os.path.basename(res['path'])}")
+    try:
+        CheckpointStore(os.path.join(CACHE_DIR, "convert_report.json")).save(
+            [{k: r[k] for k in ("path", "status", "error", "seconds")} for r in results.values()])
+    except OSError:
+        pass
+
+def convert_rules(rules, cache):
+    # Chỉ convert rule có hash chưa nằm trong cache; rule bị skip (unsupported) cache là None để lần sau không thử lại,
+    # rule lỗi (failed) không cache -> lần deploy sau thử lại
+    todo = [r for r in rules if not r["id"] or r["hash"] not in cache]
+    if not todo: return True, []
+    print(f"[*] Converting {len(todo)}/{len(rules)} new or changed Sigma rules...")
+    use_engine = SIGMA_ENGINE != 'cli' and sigma_engine.available()
+    results, loose = convert_engine(todo) if use_engine else convert_cli(todo)
+    if results is None: return False, []
+    report_conversion(results)
+    for r in todo:
+        res = results[r["path"]]
+        if r["id"] and res["status"] != "failed":
+            cache[r["hash"]] = "\n".join(res["lines"]) or None
+    return True, loose
+
+def plan_deploy(rules, cache, deployed):
+    # So trạng thái mong muốn {rule_id: hash, enabled, convert} với lần deploy trước -> dòng cần import + rule_id cần xóa
+    current, lines = {}, []
+    for r in rules:
+        line = cache.get(r["hash"]) if r["id"] else None
+        if not line: continue
+        rid = str(r["id"])
+        want = {"hash": r["hash"], "enabled": r["status"] != 'deprecated', "convert": sigma_engine.CONVERT_KEY}
+        current[rid] = want
+        if DEPLOY_MODE == 'full' or deployed.get(rid) != want:
+            lines.append(line)
+    # Chỉ xóa rule_id không còn file nào trong repo; rule convert lỗi/bị skip giữ nguyên trên Kibana
+    present = {str(r["id"]) for r in rules if r["id"]}
+    removed = [rid for rid in deployed if rid not in present]
+    return current, lines, removed
+
+def _patched_lines(src, deprecated_ids):
+    for line in src:
+        if not line.strip(): continue
+        rule = json.loads(line)
+        rule['interval'] = "1m"
+        rule['from'] = "now-120s"
+        if rule.get('rule_id') in deprecated_ids:
+            rule['enabled'] = False
+        yield json.dumps(rule) + '\n'
 
 def patch_ndjson(deprecated_ids):
     print(f"[*] Patching NDJSON for real-time monitoring (interval: 1m)...")
@@ -42,43 +147,150 @@ def patch_ndjson(deprecated_ids):
     if not os.path.exists(NDJSON_OUTPUT):
         print("[-] NDJSON file not found to patch.")
         return
-    patched_lines = []
-
-    with open(NDJSON_OUTPUT, 'r', encoding='utf-8') as f:
-        lines = [json.loads(line) for line in f if line.strip()]
-    for rule in lines:
-        rule['interval'] = "1m"
-        rule['from'] = "now-120s"
-        if rule.get('rule_id') in deprecated_ids:
-            rule['enabled'] = False
-        
-        patched_lines.append(json.dumps(rule))
-    with open(NDJSON_OUTPUT, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(patched_lines) + '\n')
+    # Đọc/ghi từng dòng sang file tạm cùng thư mục rồi os.replace: không giữ cả file trong RAM, không để lại file ghi dở
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(NDJSON_OUTPUT) or '.', prefix=".ndjson-", suffix=".tmp")
+    try:
+        with open(NDJSON_OUTPUT, 'r', encoding='utf-8') as src, os.fdopen(fd, 'w', encoding='utf-8') as dst:
+            dst.writelines(_patched_lines(src, set(deprecated_ids)))
+        os.replace(tmp, NDJSON_OUTPUT)
+    except BaseException:
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
     print("[+] Patching completed successfully.")
 
+def api_base():
+    return f"{URL}{'' if SPACE_ID == 'default' else f'/s/{SPACE_ID}'}/api/detection_engine/rules"
+
+def make_session():
+    # Import với overwrite=true là idempotent -> retry cả POST khi 429/5xx/mất kết nối
+    return http_client.kibana(URL, (USER, PASS), pool_size=IMPORT_WORKERS, retries=IMPORT_RETRIES,
+                              retry_post=True, verify=True)
+
+def iter_chunks(path, max_bytes=None, max_rules=None):
+    # Cắt NDJSON thành các lô giới hạn theo byte và số rule (giới hạn payload _import của Kibana)
+    max_bytes, max_rules = max_bytes or IMPORT_CHUNK_BYTES, max_rules or IMPORT_CHUNK_RULES
+    buf, names, size = [], {}, 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.strip(): continue
+            if buf and (size + len(line) > max_bytes or len(buf) >= max_rules):
+                yield b''.join(buf), names
+                buf, names, size = [], {}, 0
+            rule = json.loads(line)
+            names[rule.get('rule_id')] = rule.get('name')
+            buf.append(line if line.endswith(b'\n') else line + b'\n')
+            size += len(line)
+    if buf: yield b''.join(buf), names
+
+def import_chunk(session, data, names):
+    # Trả về {rule_id: thông báo lỗi}; lỗi cả request thì mọi rule trong lô đều lỗi
+    try:
+        res = session.post(f"{api_base()}/_import", params={"overwrite": "true"}, timeout=(10, 300),
+                           files={'file': ('rules.ndjson', data, 'application/x-ndjson')})
+    except Exception as e:
+        return {rid: f"Connection failed: {e}" for rid in names}, False
+    if res.status_code != 200:
+        return {rid: f"HTTP {res.status_code}: {res.text[:200]}" for rid in names}, False
+    errors = {}
+    for e in res.json().get('errors', []):
+        err = e.get('error') or {}
+        errors[e.get('rule_id')] = f"{err.get('status_code', '')} {err.get('message', e)}".strip()
+    return errors, True
+
+def import_rules():
+    # Import song song theo lô; trả về tập rule_id lỗi, None nếu không lô nào tới được Kibana
+    print(f"[*] Deploying to Space [{SPACE_ID}]...")
+    session, errors, names = make_session(), {}, {}
+    total = chunks = reached = 0
+    with ThreadPoolExecutor(max_workers=IMPORT_WORKERS) as pool:
+        pending = set()
+
+        def collect(done):
+            nonlocal reached
+            for fut in done:
+                errs, ok = fut.result()
+                errors.update(errs)
+                reached += ok
+
+        # Giữ tối đa 2 lô/worker trong bộ nhớ, đọc tiếp file khi có lô xong
+        for data, chunk_names in iter_chunks(NDJSON_OUTPUT):
+            if len(pending) >= IMPORT_WORKERS * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            names.update(chunk_names)
+            total += len(chunk_names); chunks += 1
+            pending.add(pool.submit(import_chunk, session, data, chunk_names))
+        collect(wait(pending)[0])
+    report_import(errors, names, total, chunks)
+    if chunks and not reached: return None
+    return set(errors)
+
+def report_import(errors, names, total, chunks):
+    if not errors:
+        print(f"SUCCESS! All rules deployed and optimized. ({total} rules, {chunks} chunks)")
+        return
+    # Gom lỗi theo thông báo để 1 sự cố (mất kết nối, mapping sai...) chỉ in 1 dòng
+    groups = {}
+    for rid, msg in errors.items():
+        groups.setdefault(msg, []).append(rid)
+    print(f"[-] {len(errors)}/{total} rules failed to import ({len(groups)} distinct errors):")
+    for msg, rids in sorted(groups.items(), key=lambda kv: -len(kv[1])):
+        sample = ", ".join(str(names.get(r) or r) for r in rids[:3])
+        print(f"  [-] x{len(rids)} {msg} -> {sample}{' ...' if len(rids) > 3 else ''}")
+    try:
+        CheckpointStore(os.path.join(CACHE_DIR, "import_report.json")).save(
+            [{"error": msg, "rules": [{"rule_id": r, "name": names.get(r)} for r in rids]} for msg, rids in groups.items()])
+    except OSError:
+        pass
+
+def delete_rules(rule_ids):
+    # Rule đã xóa khỏi repo -> xóa khỏi Kibana; 404 (đã bị xóa tay) cũng coi như xong
+    print(f"[*] Removing {len(rule_ids)} rules deleted from repo...")
+    session, done = make_session(), set()
+    for i in range(0, len(rule_ids), 100):
+        chunk = rule_ids[i:i + 100]
+        try:
+            res = session.post(f"{api_base()}/_bulk_delete", json=[{"rule_id": rid} for rid in chunk])
+        except Exception as e:
+            print(f"[-] Delete failed: {e}")
+            continue
+        if res.status_code != 200:
+            print(f"[-] Delete failed ({res.status_code}): {res.text}")
+            continue
+        for item in res.json():
+            err = item.get('error')
+            if not err or err.get('status_code') == 404:
+                done.add(item.get('rule_id'))
+            else:
+                print(f"  [-] {item.get('rule_id')}: {err.get('message')}")
+    return done
+
 def deploy():
-    dep_ids = process_rules()
-    cmd = f'{get_sigma_path()} convert -t lucene -p ecs_windows -f siem_rule_ndjson "{RULES_INPUT}" --skip-unsupported -o "{NDJSON_OUTPUT}"'
-    print("[*] Converting Sigma rules...")
-    if subprocess.run(cmd, shell=True, capture_output=True).returncode != 0:
+    rules, dep_ids = process_rules()
+    state_store = CheckpointStore(os.path.join(CACHE_DIR, f"deployed_{SPACE_ID}.json"))
+    cache = sigma_engine.load_cache(CACHE_DIR) if DEPLOY_MODE != 'full' else {}
+    ok, loose = convert_rules(rules, cache)
+    if not ok:
         print("[-] Conversion failed.")
         return
-    patch_ndjson(dep_ids)
-    api = f"{URL}{'' if SPACE_ID == 'default' else f'/s/{SPACE_ID}'}/api/detection_engine/rules/_import"
-    print(f"[*] Deploying to Space [{SPACE_ID}]...")
-    
-    try:
-        with open(NDJSON_OUTPUT, 'rb') as f:
-            res = requests.post(api, headers={"kbn-xsrf": "true"}, auth=(USER, PASS),
-                                files={'file': ('rules.ndjson', f, 'application/x-ndjson')},
-                                params={"overwrite": "true"})
-        if res.status_code == 200:
-            print("SUCCESS! All rules deployed and optimized.")
-        else:
-            print(f"ERROR ({res.status_code}): {res.text}")
-    except Exception as e:
-        print(f"[-] Connection failed: {e}")
+    sigma_engine.save_cache(CACHE_DIR, cache, {r["hash"] for r in rules})
+
+    deployed = state_store.load() or {}
+    current, lines, removed = plan_deploy(rules, cache, deployed)
+    lines += loose
+    print(f"[*] Plan: {len(lines)} to import, {len(removed)} to delete, {len(current) - len(lines) + len(loose)} unchanged")
+    if lines:
+        with open(NDJSON_OUTPUT, 'w', encoding='utf-8') as f:
+            f.writelines(l + '\n' for l in lines)
+        patch_ndjson(dep_ids)
+        failed = import_rules()
+        if failed is None: return
+        deployed.update({rid: v for rid, v in current.items() if rid not in failed})
+    if removed:
+        for rid in delete_rules(removed): deployed.pop(rid, None)
+    state_store.save(deployed)
+    if not lines and not removed: print("[+] Nothing changed since last deploy.")
 
 if __name__ == "__main__":
-    deploy()
\ No newline at end of file
+    deploy()
@@ -0,0 +1,91 @@
+import os
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from metrics import REGISTRY
+
+# Lớp HTTP dùng chung cho Kibana / Telegram: mỗi host 1 Session giữ keep-alive, chung chính sách retry/timeout
+# Cấu hình đọc lúc tạo session (không phải lúc import) để .env nạp sau import vẫn có hiệu lực
+DEFAULTS = {"HTTP_POOL_SIZE": 10, "HTTP_RETRIES": 3, "HTTP_BACKOFF": 0.5, "HTTP_TIMEOUT": 60.0}
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+REQUEST_SECONDS = REGISTRY.histogram("http_request_seconds", "Latency of outgoing HTTP requests", ["host", "method"])
+
+_sessions = {}
+_hooks = []
+_lock = threading.Lock()
+
+
+def setting(name):
+    default = DEFAULTS[name]
+    return type(default)(os.getenv(name, default))
+
+
+def retry_policy(retries=None, retry_post=False):
+    # retry_post chỉ bật cho request idempotent (import overwrite, bulk_delete: rule đã xóa trả 404)
+    return Retry(total=setting("HTTP_RETRIES") if retries is None else retries, backoff_factor=setting("HTTP_BACKOFF"),
+                 status_forcelist=RETRY_STATUS, allowed_methods=None if retry_post else Retry.DEFAULT_ALLOWED_METHODS,
+                 raise_on_status=False, respect_retry_after_header=True)
+
+
+def add_timing_hook(fn):
+    # fn(method, url, status_code, seconds) được gọi sau mỗi response (kể cả 4xx/5xx)
+    _hooks.append(fn)
+
+
+def _on_response(res, *args, **kwargs):
+    req = res.request
+    seconds = res.elapsed.total_seconds()
+    REQUEST_SECONDS.labels(host=urlsplit(req.url).netloc, method=req.method).observe(seconds)
+    for fn in list(_hooks):
+        try:
+            fn(req.method, req.url, res.status_code, seconds)
+        except Exception:
+            pass
+
+
+class _Session(requests.Session):
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", setting("HTTP_TIMEOUT"))
+        return super().request(method, url, **kwargs)
+
+    def close(self):
+        # Session dùng chung cho cả process: "with session:" của caller không được đóng pool
+        pass
+
+
+def session(url, auth=None, headers=None, pool_size=None, retries=None, retry_post=False, verify=True):
+    # Trả về Session dùng chung theo (host, auth, cấu hình); cùng tham số -> cùng pool kết nối
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc, auth, tuple(sorted((headers or {}).items())), retries, retry_post, verify)
+    with _lock:
+        s = _sessions.get(key)
+        if s is None:
+            s = _Session()
+            s.auth, s.verify = auth, verify
+            s.headers.update(headers or {})
+            s.hooks["response"].append(_on_response)
+            _sessions[key] = s
+        size = max(pool_size or setting("HTTP_POOL_SIZE"), getattr(s, "pool_size", 0))
+        if size > getattr(s, "pool_size", 0):
+            # Caller cần nhiều kết nối song song hơn -> thay adapter lớn hơn (pool cũ tự đóng khi không còn dùng)
+            s.pool_size = size
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size,
+                                  max_retries=retry_policy(retries, retry_post))
+            s.mount(f"{parts.scheme}://", adapter)
+        return s
+
+
+def kibana(url, auth, pool_size=None, retries=None, retry_post=False, verify=False):
+    # GUI nói chuyện với Kibana nội bộ (cert tự ký) nên mặc định không verify; deploy.py trên CI thì có
+    return session(url, auth=auth, headers={"kbn-xsrf": "true"}, pool_size=pool_size,
+                   retries=retries, retry_post=retry_post, verify=verify)
+
+
+def close_all():
+    with _lock:
+        for s in _sessions.values():
+            requests.Session.close(s)
+        _sessions.clear()
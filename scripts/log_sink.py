@@ -0,0 +1,42 @@
+import collections
+import threading
+from datetime import datetime
+
+
+class LogSink:
+    # Hàng đợi log cho GUI: thread nào cũng push được (deque.append an toàn giữa các thread),
+    # chỉ main thread của Tk drain theo lô -> mỗi nhịp after() chèn vào textbox đúng 1 lần
+    def __init__(self, max_lines=5000, spill_path=None):
+        self.max_lines = max_lines
+        # Chưa kịp drain mà vượt max_lines thì dòng cũ nhất bị bỏ (đằng nào cũng bị cắt khỏi textbox)
+        self.pending = collections.deque(maxlen=max_lines)
+        self._spill = open(spill_path, "a", encoding="utf-8") if spill_path else None
+        self._lock = threading.Lock()
+
+    def push(self, msg):
+        line = f"[{datetime.now().strftime('%H:%M:%S')}] > {msg}\n"
+        if self._spill:
+            # File giữ đầy đủ lịch sử (ghi vào buffer, flush theo lô khi drain), textbox chỉ giữ max_lines dòng cuối
+            with self._lock:
+                if self._spill: self._spill.write(line)
+        self.pending.append(line)
+
+    def drain(self, limit=None):
+        lines = []
+        limit = limit or self.max_lines
+        try:
+            while len(lines) < limit:
+                lines.append(self.pending.popleft())
+        except IndexError:
+            pass
+        if lines and self._spill:
+            with self._lock:
+                if self._spill: self._spill.flush()
+        return lines
+
+    def close(self):
+        self.drain()
+        with self._lock:
+            if self._spill:
+                self._spill.close()
+                self._spill = None
@@ -10,12 +10,12 @@ import threading
 import winsound
 import psutil
 import time
-from datetime import datetime
 import customtkinter as ctk
 from tkinter import filedialog, messagebox, ttk
 
 from alert import AlertMonitor
 from manager import RuleManager
+from log_sink import LogSink
 
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
@@ -30,6 +30,9 @@ COLOR_BORDER = "#E4E6EB"
 COLOR_STATUS_GREEN = "#28A745" 
 COLOR_NEON_RED = "#FF3B30"     
 COLOR_DARK_RED = "#660000"     
+SEARCH_DEBOUNCE_MS = 150
+LOG_FLUSH_MS = int(os.getenv("GUI_LOG_FLUSH_MS", "100"))
+LOG_MAX_LINES = int(os.getenv("GUI_LOG_MAX_LINES", "5000"))
 
 ctk.set_appearance_mode("light") 
 
@@ -47,6 +50,8 @@ class SOCXCommand(ctk.CTk):
         self.is_folder = False
         self.blink_state = False
         self.progress = None
+        # Log từ mọi thread đi qua LogSink, main thread vẽ theo lô (_flush_log)
+        self.log_sink = LogSink(LOG_MAX_LINES, os.getenv("GUI_LOG_FILE") or None)
         
         # --- 2. GÁN PLACEHOLDER ĐỂ TRÁNH LỖI KHI VẼ UI ---
         self.logic = None 
@@ -57,11 +62,16 @@ class SOCXCommand(ctk.CTk):
         # --- 4. KHỞI TẠO MONITOR & LOGIC SAU (Khi log_box đã sẵn sàng) ---
         self.monitor_system = AlertMonitor()
         self.logic = RuleManager(self.RULES_DIR, self.write_log)
+        self.logic.start_watcher()
+        # Lần xóa trước bị ngắt (tắt app/mất mạng) -> hỏi chạy tiếp
+        self.after(0, self.logic.resume_delete, self.refresh_from_worker)
 
         # --- 5. CẬP NHẬT DỮ LIỆU LÊN GIAO DIỆN ---
         self.update_ui_list()
         
         threading.Thread(target=self._update_system_stats, daemon=True).start()
+        self.after(500, self._poll_rule_changes)
+        self.after(LOG_FLUSH_MS, self._flush_log)
 
     def _init_ui(self):
         self.configure(fg_color=COLOR_BG_LIGHT)
@@ -132,7 +142,8 @@ class SOCXCommand(ctk.CTk):
 
         self.search_var = ctk.StringVar()
         # Dùng Lambda để tránh lỗi NoneType lúc khởi tạo
-        self.search_var.trace_add("write", lambda *args: self.logic.filter_logic(self.search_var.get(), self.mode_var.get(), self.tree, self.drop) if self.logic else None)
+        self._search_job = None
+        self.search_var.trace_add("write", lambda *args: self._schedule_search())
 
         ctk.CTkEntry(top, placeholder_text="Search rules...", textvariable=self.search_var, width=320, height=35).pack(side="left", padx=(0, 10))
 
@@ -147,14 +158,17 @@ class SOCXCommand(ctk.CTk):
             ctk.CTkButton(bot, text=text, width=80, height=35, fg_color=color, font=("Segoe UI", 11, "bold"),
                           command=lambda s=status: self.logic.set_status(s, self.tree, self.update_ui_list)).pack(side="left", padx=2)
 
-        ctk.CTkButton(bot, text="DELETE", width=80, height=35, fg_color="#6C757D", font=("Segoe UI", 11, "bold"), command=lambda: self.logic.delete(self.tree, self.mode_var.get(), self.update_ui_list)).pack(side="left", padx=(10, 5))
+        ctk.CTkButton(bot, text="DELETE", width=80, height=35, fg_color="#6C757D", font=("Segoe UI", 11, "bold"), command=lambda: self.logic.delete(self.tree, self.mode_var.get(), self.refresh_from_worker)).pack(side="left", padx=(10, 5))
         ctk.CTkButton(bot, text="RESTORE", width=80, height=35, fg_color="transparent", border_width=1, text_color="#65676B", font=("Segoe UI", 11, "bold"), command=lambda: self.logic.restore(self.mode_var.get(), self.update_ui_list)).pack(side="left")
-        ctk.CTkButton(bot, text="SYNC AUDIT", width=100, height=35, fg_color="#007AFF", font=("Segoe UI", 11, "bold"), command=lambda: self.logic.sync_audit()).pack(side="left", padx=10)
+        ctk.CTkButton(bot, text="SYNC AUDIT", width=100, height=35, fg_color="#007AFF", font=("Segoe UI", 11, "bold"), command=lambda: self.logic.sync_audit(on_report=lambda rep: self.after(0, self.show_audit_report, rep))).pack(side="left", padx=10)
 
         self.drop = ctk.CTkFrame(container, fg_color="#FFFFFF", border_width=1, border_color="#E4E6EB")
         self.tree = ttk.Treeview(self.drop, columns=("Status", "Title"), show="headings", height=8)
         self.tree.heading("Status", text="STATUS"); self.tree.column("Status", width=80, anchor="center")
         self.tree.heading("Title", text="TITLE"); self.tree.column("Title", width=420, anchor="w")
+        self.tree_scroll = ttk.Scrollbar(self.drop, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._on_tree_scroll)
+        self.tree_scroll.pack(side="right", fill="y", pady=2)
         self.tree.pack(fill="both", expand=True, padx=2, pady=2)
 
         # --- TERMINAL ---
@@ -178,6 +192,59 @@ class SOCXCommand(ctk.CTk):
             self.logic.load_rules_data()
             self.logic.filter_logic(self.search_var.get(), self.mode_var.get(), self.tree, self.drop)
 
+    def refresh_from_worker(self):
+        # Thread xóa gọi lại từ ngoài main thread: đẩy về Tk thread, chỉ Tk thread được đụng Treeview/state render
+        self.after(0, self.update_ui_list)
+
+    def _schedule_search(self):
+        # Debounce: gõ liên tục thì chỉ tìm 1 lần sau khi ngừng gõ SEARCH_DEBOUNCE_MS
+        if self._search_job: self.after_cancel(self._search_job)
+        self._search_job = self.after(SEARCH_DEBOUNCE_MS, self._run_search)
+
+    def _run_search(self):
+        self._search_job = None
+        if self.logic: self.logic.filter_logic(self.search_var.get(), self.mode_var.get(), self.tree, self.drop)
+
+    def _on_tree_scroll(self, first, last):
+        self.tree_scroll.set(first, last)
+        if self.logic and float(last) >= 0.95: self.logic.load_more(self.tree)
+
+    def _poll_rule_changes(self):
+        try: self.logic.apply_pending_changes()
+        except Exception as e: self.write_log(f"[-] Rule watcher error: {e}")
+        self.after(500, self._poll_rule_changes)
+
+    def show_audit_report(self, report):
+        win = ctk.CTkToplevel(self)
+        win.title(f"SYNC AUDIT - {report.get('space', '')}")
+        win.geometry("900x500")
+        summary = (f"Repo: {report['repo']}   Kibana: {report['kibana']}   Khớp: {report['in_sync']}   "
+                   f"Lệch nội dung: {len(report['changed'])}   Chỉ ở Repo: {len(report['only_in_repo'])}   "
+                   f"Chỉ ở Kibana: {len(report['only_in_kibana'])}   ({report['seconds']}s)")
+        ctk.CTkLabel(win, text=summary, font=("Segoe UI", 12, "bold"), text_color=COLOR_TEXT_DARK).pack(anchor="w", padx=15, pady=10)
+        frame = ctk.CTkFrame(win, fg_color="#FFFFFF")
+        frame.pack(fill="both", expand=True, padx=15, pady=(0, 15))
+        tree = ttk.Treeview(frame, columns=("Drift", "Rule", "Detail"), show="headings")
+        tree.heading("Drift", text="DRIFT"); tree.column("Drift", width=120, anchor="center")
+        tree.heading("Rule", text="RULE"); tree.column("Rule", width=280, anchor="w")
+        tree.heading("Detail", text="DETAIL"); tree.column("Detail", width=460, anchor="w")
+        sb = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=sb.set)
+        sb.pack(side="right", fill="y"); tree.pack(fill="both", expand=True)
+        for r in report["changed"]:
+            detail = "; ".join(f"{f}: {str(r['repo'][f])[:60]} → {str(r['kibana'][f])[:60]}" for f in r["fields"])
+            tree.insert("", "end", values=("CHANGED", r["file"], detail))
+        for r in report["only_in_repo"]:
+            tree.insert("", "end", values=("ONLY IN REPO", r["file"], r["rule_id"]))
+        for r in report["only_in_kibana"]:
+            tree.insert("", "end", values=("ONLY IN KIBANA", r["name"] or "", r["rule_id"]))
+        for r in report["not_deployable"]:
+            tree.insert("", "end", values=("UNSUPPORTED", r["file"], r["rule_id"]))
+        for r in report.get("unverified", []):
+            tree.insert("", "end", values=("UNVERIFIED", r["file"], r["rule_id"]))
+        for f in report.get("incomplete", []):
+            tree.insert("", "end", values=("FETCH FAILED", f"rule_id {f['bucket']}*", f["error"][:200]))
+
     def _show_progress(self):
         if self.progress is None:
             self.progress = ctk.CTkProgressBar(self.sidebar, width=200, height=12, progress_color=COLOR_ACCENT, fg_color=COLOR_BORDER)
@@ -231,8 +298,18 @@ class SOCXCommand(ctk.CTk):
             self.status_indicator.configure(text="● SYSTEM READY", text_color=COLOR_STATUS_GREEN)
 
     def write_log(self, msg):
-        self.log_box.insert("end", f"[{datetime.now().strftime('%H:%M:%S')}] > {msg}\n")
-        self.log_box.see("end")
+        # Gọi được từ mọi thread: chỉ đẩy vào hàng đợi, không đụng vào widget
+        self.log_sink.push(msg)
+
+    def _flush_log(self):
+        lines = self.log_sink.drain()
+        if lines:
+            follow = self.log_box.yview()[1] >= 0.999  # đang xem cuối log thì mới tự cuộn theo
+            self.log_box.insert("end", "".join(lines))
+            excess = int(self.log_box.index("end-1c").split(".")[0]) - 1 - LOG_MAX_LINES
+            if excess > 0: self.log_box.delete("1.0", f"{excess + 1}.0")
+            if follow: self.log_box.see("end")
+        self.after(LOG_FLUSH_MS, self._flush_log)
 
     def clear_log(self):
         self.log_box.delete("1.0", "end"); self.write_log("LOG SYSTEM RESET.")
@@ -302,4 +379,5 @@ class SOCXCommand(ctk.CTk):
 
 if __name__ == "__main__":
     app = SOCXCommand()
-    app.mainloop()
\ No newline at end of file
+    app.mainloop()
+    app.log_sink.close()
@@ -1,10 +1,22 @@
 import os
+import queue
 import yaml
-import requests
 import shutil
 import subprocess
 import threading
+from itertools import islice
 from tkinter import messagebox, filedialog
+from rule_catalog import RuleCatalog
+from rule_watcher import RuleWatcher
+from rule_search import RuleIndex
+from checkpoint import CheckpointStore
+from bulk_ops import BulkDelete
+import http_client
+
+RENDER_PAGE = 200  # số dòng vẽ lên Treeview mỗi lần, cuộn gần cuối thì vẽ thêm
+DELETE_WORKERS = int(os.getenv("DELETE_WORKERS", "4"))
+# Rule Kibana trả 404 khi xóa (chưa từng deploy / đã bị xóa trước đó): "keep" giữ file trong repo, "trash" chuyển vào trash như rule đã xóa
+DELETE_ABSENT = os.getenv("DELETE_ABSENT", "keep").lower()
 
 class RuleManager:
     def __init__(self, rules_dir, log_func):
@@ -14,7 +26,25 @@ class RuleManager:
         self.log_func(f"[*] Rule Manager Active: {self.env_name} (Space: {self.space_id})")
         self.trash_dir = "trash"
         os.makedirs(self.trash_dir, exist_ok=True)
-        self.all_rules = []
+        # Nạp catalog đã lưu -> có danh sách rule ngay khi mở GUI mà không phải parse YAML
+        self.catalog = RuleCatalog(rules_dir, os.getenv("RULE_CATALOG_FILE", ".rule_catalog.json"))
+        self.catalog.load()
+        self.index = RuleIndex()
+        self.index.sync(self.catalog.rules())
+        # Catalog riêng cho trash: restore/xóa làm ngoài GUI (git pull, mv tay) vẫn được watcher cập nhật
+        self.trash = RuleCatalog(self.trash_dir, os.getenv("TRASH_CATALOG_FILE", ".trash_catalog.json"))
+        self.trash.load()
+        self.journal = CheckpointStore(os.getenv("DELETE_JOURNAL_FILE", ".delete_journal.json"))
+        self._deleting = False
+        # Watcher đẩy lô path thay đổi vào queue, main thread (after()) lấy ra và cập nhật danh sách
+        self.watcher = None
+        self._changes = queue.Queue()
+        self._view = None
+        self._results, self._more, self._rendered = [], iter(()), {}
+
+    @property
+    def all_rules(self):
+        return self.index.rules()
 
     def _detect_environment(self):
         try:
@@ -28,28 +58,69 @@ class RuleManager:
         drop_frame.pack_forget()
 
     def filter_logic(self, term, mode, tree, drop_frame):
+        # Cùng term/mode (refresh, watcher) thì giữ số dòng đã vẽ để không nhảy vị trí cuộn
+        same = self._view is not None and self._view[:2] == (term, mode)
+        self._view = (term, mode, tree, drop_frame)
         term = term.lower().strip()
         if not term:
             drop_frame.pack_forget()
             return
-        tree.delete(*tree.get_children())
+        want = max(RENDER_PAGE, len(self._results) if same else 0)
         if mode == "Folder Mode":
-            seen = set()
-            for r in self.all_rules:
-                folder = os.path.dirname(r['path'])
-                fname = os.path.basename(folder)
-                if term in fname.lower() and folder not in seen:
-                    tree.insert("", "end", values=("DIR", f"Folder: {fname}"), tags=(folder,))
-                    seen.add(folder)
+            self._more = (("D", f) for f in self.index.search_folders(term))
         else:
-            for r in self.all_rules:
-                if term in r['file'].lower() or term in r['title'].lower():
-                    tree.insert("", "end", values=(r['status'], r['title']), tags=(r['path'],))
+            self._more = (("F", p) for p in self.index.search(term))
+        self._results = list(islice(self._more, want))
+        self._render(tree)
         if tree.get_children(): drop_frame.pack(fill="x", pady=(5, 0))
 
+    def load_more(self, tree):
+        # Kết quả được lấy lười từ generator, chỉ vẽ thêm 1 trang khi cuộn tới cuối
+        more = list(islice(self._more, RENDER_PAGE))
+        if not more: return
+        self._results += more
+        self._render(tree)
+
+    def _row(self, kind, path):
+        if kind == "D":
+            return f"D|{path}", ("DIR", f"Folder: {os.path.basename(path)}"), path
+        r = self.index.rows.get(path)
+        return r and (f"F|{path}", (r['status'], r['title']), path)
+
+    def _render(self, tree):
+        # Diff với những dòng đang hiển thị: chỉ xóa/chèn/di chuyển/sửa dòng khác biệt
+        want = [x for x in (self._row(*x) for x in self._results) if x]
+        keep = {iid for iid, _, _ in want}
+        cur = tree.get_children()
+        gone = [i for i in cur if i not in keep]
+        if gone:
+            tree.delete(*gone)
+            for i in gone: self._rendered.pop(i, None)
+        cur = [i for i in cur if i in keep]
+        for pos, (iid, values, tag) in enumerate(want):
+            if pos < len(cur) and cur[pos] == iid:
+                if self._rendered.get(iid) != values: tree.item(iid, values=values)
+            elif tree.exists(iid):
+                tree.move(iid, "", pos); tree.item(iid, values=values)
+                cur.remove(iid); cur.insert(pos, iid)
+            else:
+                tree.insert("", pos, iid=iid, values=values, tags=(tag,))
+                cur.insert(pos, iid)
+            self._rendered[iid] = values
+
     def delete(self, tree, mode, refresh_callback):
         sel = tree.selection()
         if not sel: return
+        if self._deleting: return self.log_func("[-] A delete is still running, wait for it to finish.")
+        # Journal dở dang là trạng thái resume duy nhất: không ghi đè, phải chạy tiếp (hoặc bỏ khi mở app) trước
+        unfinished = self.journal.load()
+        if unfinished and unfinished.get("op") == "delete":
+            other = os.path.basename(os.path.normpath(unfinished["target"]))
+            if messagebox.askyesno("Resume", f"Unfinished delete of {other} ({len(unfinished['pending'])} pending) must finish first. Resume it now?"):
+                self._resume(unfinished, refresh_callback)
+            else:
+                self.log_func(f"[-] New delete refused: unfinished delete of {other} is still in the journal.")
+            return
         path = tree.item(sel[0], "tags")[0]
         name = os.path.basename(path)
         if not messagebox.askyesno("Confirm", f"Delete {mode}: {name}?"): return
@@ -57,83 +128,151 @@ class RuleManager:
 
         def _delete_task():
             current_branch, space_id = self._detect_environment()
-            host = os.getenv('KIBANA_HOST', '').rstrip('/')
-            api_endpoint = f"{host}/api/detection_engine/rules/_bulk_delete" if space_id == "default" else f"{host}/s/{space_id}/api/detection_engine/rules/_bulk_delete"
             try:
-                targets = []
-                if mode == "Folder Mode":
-                    for r, _, fs in os.walk(path):
-                        for f in fs:
-                            if f.endswith(('.yml', '.yaml')): targets.append(os.path.join(r, f))
-                else: targets = [path]
-                payload_full = []
-                for p in targets:
-                    try:
-                        with open(p, encoding='utf-8') as f:
-                            rid = yaml.safe_load(f).get('id')
-                            if rid: payload_full.append({"rule_id": rid})
-                    except: continue
-                if not payload_full: return self.log_func("[-] No valid Rule IDs found.")
-                chunk_size = 100
-                chunks = [payload_full[i:i + chunk_size] for i in range(0, len(payload_full), chunk_size)]
-                success_on_siem = True
-                for chunk in chunks:
-                    res = requests.post(api_endpoint, auth=(os.getenv('ELASTIC_USER'), os.getenv('ELASTIC_PASS')), headers={"kbn-xsrf": "true", "Content-Type": "application/json"}, json=chunk, verify=False, timeout=60)
-                    if res.status_code != 200: success_on_siem = False; break
-                if success_on_siem:
-                    dest = os.path.join(self.trash_dir, f"{name}_dir" if mode == "Folder Mode" else name)
-                    if os.path.exists(dest): shutil.rmtree(dest) if os.path.isdir(dest) else os.remove(dest)
-                    shutil.move(path, dest)
-                    subprocess.run(["git", "add", "."], check=True)
-                    subprocess.run(["git", "commit", "-m", f"SOC-GUI: Deleted {name}"], check=True)
-                    subprocess.run(["git", "push", "origin", current_branch], check=True)
-                    self.log_func(f"SUCCESS: Removed and Git synced.")
+                self.catalog.refresh()
+                targets = {str(rid): p for rid, p in self.catalog.ids_under(path).items()}
+                if not targets: return self.log_func("[-] No valid Rule IDs found.")
+                state = {"op": "delete", "target": path, "mode": mode, "space": space_id, "branch": current_branch,
+                         "pending": targets, "done": {}, "absent": {}, "failed": {}, "moved": []}
+                self.journal.save(state)
+                self._run_delete(state)
             except Exception as e: self.log_func(f"[-] Critical Error: {e}")
-            finally: refresh_callback()
+            finally:
+                self._deleting = False
+                refresh_callback()
+        self._deleting = True
         threading.Thread(target=_delete_task, daemon=True).start()
 
-    def sync_audit(self):
+    def resume_delete(self, refresh_callback):
+        # Lần xóa trước bị ngắt giữa chừng (Kibana đã xóa 1 phần, file vẫn còn) -> hỏi để chạy tiếp và đối soát
+        state = self.journal.load()
+        if not state or state.get("op") != "delete": return
+        name = os.path.basename(os.path.normpath(state["target"]))
+        if not messagebox.askyesno("Resume", f"Unfinished delete of {name} ({len(state['pending'])} pending, {len(state['done'])} deleted). Resume?"):
+            self.log_func(f"[!] Discarded unfinished delete journal of {name}.")
+            return os.remove(self.journal.path)
+        self._resume(state, refresh_callback)
+
+    def _resume(self, state, refresh_callback):
+        name = os.path.basename(os.path.normpath(state["target"]))
+
+        def _resume_task():
+            try:
+                self.log_func(f"[*] Resuming delete of {name}...")
+                self._run_delete(state)
+            except Exception as e: self.log_func(f"[-] Critical Error: {e}")
+            finally:
+                self._deleting = False
+                refresh_callback()
+        self._deleting = True
+        threading.Thread(target=_resume_task, daemon=True).start()
+
+    def _run_delete(self, state):
+        host = os.getenv('KIBANA_HOST', '').rstrip('/')
+        space_id = state["space"]
+        api_endpoint = f"{host}/api/detection_engine/rules/_bulk_delete" if space_id == "default" else f"{host}/s/{space_id}/api/detection_engine/rules/_bulk_delete"
+        if state["pending"]:
+            # _bulk_delete chạy lại an toàn (rule đã xóa trả 404) -> retry cả POST
+            session = http_client.kibana(host, (os.getenv('ELASTIC_USER'), os.getenv('ELASTIC_PASS')),
+                                         pool_size=DELETE_WORKERS, retry_post=True)
+            BulkDelete(session, api_endpoint, self.journal, workers=DELETE_WORKERS).run(state)
+        absent = state.setdefault("absent", {})
+        self.log_func(f"[!] Kibana: {len(state['done'])} deleted, {len(absent)} not found, {len(state['pending'])} failed.")
+        for rid in list(state["pending"])[:20]:
+            self.log_func(f"  [-] {os.path.basename(state['pending'][rid])}: {state['failed'].get(rid)}")
+        if absent:
+            action = "moved to trash" if DELETE_ABSENT == "trash" else "kept in the repo (DELETE_ABSENT=keep)"
+            self.log_func(f"[*] {len(absent)} rule(s) were not on Kibana (never deployed, or deleted earlier); files {action}:")
+            for p in list(absent.values())[:20]:
+                self.log_func(f"  ? {os.path.basename(p)}")
+        moved = self._trash_deleted(state)
+        self.journal.save(state)
+        if moved:
+            name = os.path.basename(os.path.normpath(state["target"]))
+            subprocess.run(["git", "add", "-A", "--", self.rules_dir, self.trash_dir], check=True)
+            subprocess.run(["git", "commit", "-m", f"SOC-GUI: Deleted {name} ({moved} rules)"], check=True)
+            subprocess.run(["git", "push", "origin", state["branch"]], check=True)
+            self.log_func(f"SUCCESS: Removed {moved} rules and Git synced.")
+        if state["pending"]:
+            self.log_func("[-] Some rules were not deleted on Kibana; their files stay in the repo. Restart the app to resume.")
+        else:
+            os.remove(self.journal.path)
+
+    def _trash_deleted(self, state):
+        # Chỉ chuyển vào trash những file có rule đã thực sự bị xóa trên Kibana
+        target, folder_mode = state["target"], state["mode"] == "Folder Mode"
+        name = os.path.basename(os.path.normpath(target))
+        absent = list(state.get("absent", {}).values())
+        keep = set() if DELETE_ABSENT == "trash" else {os.path.normpath(p) for p in absent}
+        todo = [p for p in list(state["done"].values()) + ([] if keep else absent) if p not in state["moved"] and os.path.exists(p)]
+        if folder_mode and not state["pending"] and not state["moved"] and not keep and os.path.isdir(target):
+            # Xóa trọn thư mục ngay lần đầu: giữ hành vi cũ, chuyển cả thư mục (kể cả file không có id)
+            dest = os.path.join(self.trash_dir, f"{name}_dir")
+            if os.path.exists(dest): shutil.rmtree(dest) if os.path.isdir(dest) else os.remove(dest)
+            shutil.move(target, dest)
+            state["moved"] += todo
+            return len(todo)
+        for p in todo:
+            dest = os.path.join(self.trash_dir, f"{name}_dir", os.path.relpath(p, target)) if folder_mode else os.path.join(self.trash_dir, os.path.basename(p))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if os.path.exists(dest): os.remove(dest)
+            shutil.move(p, dest)
+            state["moved"].append(p)
+        if folder_mode and not state["pending"] and os.path.isdir(target):
+            # Chạy tiếp sau lần xóa dở: gộp phần còn lại của thư mục vào trash đã có
+            # File của rule không có trên Kibana mà DELETE_ABSENT=keep thì để nguyên chỗ cũ
+            dest = os.path.join(self.trash_dir, f"{name}_dir")
+            for root, _, files in os.walk(target):
+                for f in files:
+                    src = os.path.join(root, f)
+                    if os.path.normpath(src) in keep: continue
+                    out = os.path.join(dest, os.path.relpath(src, target))
+                    os.makedirs(os.path.dirname(out), exist_ok=True)
+                    shutil.move(src, out)
+            for root, _, _ in os.walk(target, topdown=False):
+                if not os.listdir(root): os.rmdir(root)
+        return len(todo)
+
+    def sync_audit(self, on_report=None):
         def _task():
             _, space_id = self._detect_environment()
             host = os.getenv('KIBANA_HOST', '').rstrip('/')
-            api = f"{host}{'' if space_id == 'default' else f'/s/{space_id}'}/api/detection_engine/rules/_find"
+            base = f"{host}{'' if space_id == 'default' else f'/s/{space_id}'}/api/detection_engine/rules"
             try:
+                from audit import run_audit  # kéo theo pySigma, chỉ nạp khi thật sự audit
                 self.log_func("[*] Đang đối soát dữ liệu Repo và Kibana...")
-                res = requests.get(
-                    api, 
-                    auth=(os.getenv('ELASTIC_USER'), os.getenv('ELASTIC_PASS')),
-                    headers={"kbn-xsrf": "true"}, 
-                    params={"per_page": 1000}, 
-                    verify=False, 
-                    timeout=20
-                )
-                kibana_data = res.json().get('data', [])
-                kibana_ids = {r['rule_id'] for r in kibana_data}
-                repo_map = {}
-                for r in self.all_rules:
-                    try:
-                        with open(r['path'], encoding='utf-8') as f:
-                            rid = yaml.safe_load(f).get('id')
-                            if rid:
-                                repo_map[rid] = r['file']
-                    except:
-                        continue
-                repo_ids = set(repo_map.keys())
-                only_in_repo = repo_ids - kibana_ids
-                only_in_kibana = kibana_ids - repo_ids
-                self.log_func(f"[!] Thống kê: Repo({len(repo_ids)}) | Kibana({len(kibana_ids)})")
-                if not only_in_repo and not only_in_kibana:
+                self.catalog.refresh()
+                report = run_audit(base, self.catalog, (os.getenv('ELASTIC_USER'), os.getenv('ELASTIC_PASS')),
+                                   os.getenv('DEPLOY_CACHE_DIR', '.deploy_cache'), self.log_func)
+                report["space"] = space_id
+                CheckpointStore(os.getenv('AUDIT_REPORT_FILE', '.audit_report.json')).save(report)
+                only_in_repo, only_in_kibana, changed = report["only_in_repo"], report["only_in_kibana"], report["changed"]
+                self.log_func(f"[!] Thống kê: Repo({report['repo']}) | Kibana({report['kibana']}) | Khớp({report['in_sync']}) | {report['seconds']}s")
+                if report["kibana"] < report["kibana_total"]:
+                    self.log_func(f"[-] Kibana báo {report['kibana_total']} rule nhưng chỉ lấy được {report['kibana']}, hãy chạy lại audit.")
+                for f in report["incomplete"]:
+                    self.log_func(f"[-] Không lấy được nhóm rule_id '{f['bucket']}*': {f['error']}")
+                if report["unverified"]:
+                    self.log_func(f"[*] {len(report['unverified'])} rule thuộc nhóm lỗi ở trên, chưa kiểm tra được.")
+                if not only_in_repo and not only_in_kibana and not changed:
                     self.log_func("[+] Đồng bộ hoàn toàn 100%")
                 else:
-                    self.log_func(f"--- CHI TIẾT SAI LỆCH ({len(only_in_repo) + len(only_in_kibana)}) ---")
+                    self.log_func(f"--- CHI TIẾT SAI LỆCH ({len(only_in_repo) + len(only_in_kibana) + len(changed)}) ---")
                     if only_in_repo:
                         self.log_func(f"[*] Có ở Repo nhưng chưa có trên Kibana ({len(only_in_repo)}):")
-                        for rid in only_in_repo:
-                            self.log_func(f"  + {repo_map[rid]}")
+                        for r in only_in_repo:
+                            self.log_func(f"  + {r['file']}")
                     if only_in_kibana:
                         self.log_func(f"[*] Có trên Kibana nhưng đã mất trong Repo ({len(only_in_kibana)}):")
-                        for rid in only_in_kibana:
-                            self.log_func(f"  - ID: {rid}")
+                        for r in only_in_kibana:
+                            self.log_func(f"  - ID: {r['rule_id']}")
+                    if changed:
+                        self.log_func(f"[*] Lệch nội dung giữa Repo và Kibana ({len(changed)}):")
+                        for r in changed:
+                            self.log_func(f"  ~ {r['file']}: {', '.join(r['fields'])}")
+                if report["not_deployable"]:
+                    self.log_func(f"[*] {len(report['not_deployable'])} rule không convert được (unsupported), bỏ qua.")
+                if on_report: on_report(report)
             except Exception as e:
                 self.log_func(f"[-] Lỗi đối soát: {str(e)}")
         threading.Thread(target=_task, daemon=True).start()
@@ -148,16 +287,35 @@ class RuleManager:
         except Exception as e: self.log_func(f"[-] Restore error: {e}")
 
     def load_rules_data(self):
-        self.all_rules.clear()
-        for root, _, files in os.walk(self.rules_dir):
-            for f in files:
-                if f.lower().endswith(('.yml', '.yaml')):
-                    p = os.path.join(root, f)
-                    try:
-                        with open(p, encoding='utf-8') as file:
-                            d = yaml.safe_load(file)
-                            if d: self.all_rules.append({"path": p, "file": f, "title": d.get('title', 'N/A'), "status": 'OFF' if str(d.get('status', '')).lower() == 'deprecated' else 'ON'})
-                    except: pass
+        self.catalog.refresh()
+        self.trash.refresh()
+        self.index.sync(self.catalog.rules())
+
+    def start_watcher(self):
+        if self.watcher: return
+        self.watcher = RuleWatcher([self.rules_dir, self.trash_dir], self._changes.put)
+        self.watcher.start()
+        self.log_func(f"[*] Rule watcher active ({self.watcher.backend})")
+
+    def apply_pending_changes(self):
+        # Chạy trên main thread: chỉ parse lại file bị đụng tới và sửa đúng những dòng đó, không reload toàn bộ
+        paths = set()
+        while True:
+            try: paths |= self._changes.get_nowait()
+            except queue.Empty: break
+        if not paths: return 0
+        # Mỗi catalog bỏ qua path nằm ngoài thư mục của nó -> lô lẫn rules/trash tự tách đúng chỗ
+        trashed = self.trash.update_paths(paths)
+        if trashed:
+            self.log_func(f"[*] Trash changed: {len(trashed)} rule file(s), {len(self.trash.entries)} in trash")
+        affected = self.catalog.update_paths(paths)
+        if not affected: return 0
+        for p in affected:
+            row = self.catalog.rule_view(p)
+            if row: self.index.put(row)
+            else: self.index.discard(p)
+        if self._view: self.filter_logic(*self._view)
+        return len(affected)
 
     def set_status(self, status, tree, refresh_callback):
         for item in tree.selection():
@@ -0,0 +1,325 @@
+import itertools
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import requests
+import http_client
+from ratelimit import TokenBucket
+from metrics import REGISTRY
+
+SENT = REGISTRY.counter("alert_messages_sent_total", "Alerts delivered to Telegram (a digest carries several)")
+FAILED = REGISTRY.counter("alert_messages_failed_total", "Alerts given up after retries")
+DROPPED = REGISTRY.counter("alert_messages_dropped_total", "Messages dropped because the delivery queue was full")
+DIGESTS = REGISTRY.counter("alert_telegram_messages_total", "sendMessage calls that succeeded")
+RATE_LIMITED = REGISTRY.counter("alert_telegram_rate_limited_total", "429 responses from Telegram")
+SEND_SECONDS = REGISTRY.histogram("alert_telegram_send_seconds", "Latency of one Telegram sendMessage call")
+E2E_SECONDS = REGISTRY.histogram("alert_end_to_end_seconds", "Alert @timestamp to Telegram delivery",
+                                 buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200))
+
+MAX_MESSAGE = 4096  # giới hạn ký tự 1 tin của Telegram
+DIGEST_SEP = "\n\n"
+
+
+def pack_digest(items, limit=MAX_MESSAGE):
+    # items đã sắp theo risk giảm dần: lấy liên tiếp tới tin đầu tiên không còn vừa (tin đó mở đầu digest sau),
+    # nên tin risk thấp không bao giờ chen lên trước tin risk cao hơn
+    size = 0
+    for i, item in enumerate(items):
+        size += len(item[2]) + (len(DIGEST_SEP) if i else 0)
+        if i and size > limit:
+            return items[:i], items[i:]
+    return items, []
+
+
+def fit_message(msg, limit=MAX_MESSAGE):
+    # 1 alert dài hơn giới hạn (evidence rất dài...): cắt bớt nhưng giữ HTML hợp lệ cho parse_mode=HTML
+    if len(msg) <= limit:
+        return msg
+    cut = limit - 64
+    while True:
+        text = msg[:cut]
+        if text.rfind("<") > text.rfind(">"):
+            text = text[:text.rfind("<")]
+        if text.rfind("&") > text.rfind(";"):
+            text = text[:text.rfind("&")]
+        opened = []
+        for closing, tag in re.findall(r"<(/?)(\w+)[^>]*>", text):
+            if not closing:
+                opened.append(tag)
+            elif opened and opened[-1] == tag:
+                opened.pop()
+        text += "…" + "".join(f"</{tag}>" for tag in reversed(opened))
+        if len(text) <= limit:
+            return text
+        cut -= len(text) - limit
+
+
+def retry_after(res, default=1.0):
+    # Telegram: {"parameters": {"retry_after": N}}; proxy / Bot API server tự host có thể chỉ trả header Retry-After
+    try:
+        return float(res.json()["parameters"]["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        pass
+    try:
+        return float(res.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return default
+
+
+class TelegramNotifier:
+    def __init__(self, token, chat_id, max_queue=1000, workers=2, max_retries=3, backoff=1.0, log_func=print,
+                 rate=1.0, burst=3, max_length=MAX_MESSAGE, shutdown_timeout=30.0, spill_path=None):
+        # TELEGRAM_API_URL: Bot API server tự host / proxy (benchmark trỏ vào server giả lập)
+        api = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+        self.url = f"{api}/bot{token}/sendMessage"
+        self.chat_id = chat_id
+        # queue.unfinished_tasks = tin đang chờ + đang gom + đang gửi -> dùng để giới hạn max_queue
+        self.queue = queue.Queue()
+        self.max_queue = max_queue
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.log_func = log_func
+        # Telegram giới hạn theo từng chat (~1 tin/giây): mỗi chat 1 token bucket, các worker dùng chung
+        self.rate = rate
+        self.burst = burst
+        self.max_length = max_length
+        self._buckets = {}
+        self._pending = {}   # chat -> [(-risk, seq, msg, event_ts)] đã lấy khỏi queue, chờ token để gom digest
+        self._seq = itertools.count()
+        # Dừng: xả hàng đợi tối đa shutdown_timeout giây, phần chưa gửi kịp ghi ra spill_path (JSONL) và gửi lại ở lần start sau
+        self.shutdown_timeout = shutdown_timeout
+        self.spill_path = spill_path
+        self._inflight = {}  # thread id -> (chat, batch) đang gửi
+
+        # Session dùng chung (keep-alive tới api.telegram.org); retry do _deliver tự làm để dừng được khi stop
+        self.session = http_client.session(self.url, pool_size=workers, retries=0)
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._abort = threading.Event()  # hết hạn shutdown: bỏ mọi lần chờ token / retry_after
+        self._threads = []
+        self.stats = {"queued": 0, "sent": 0, "failed": 0, "dropped": 0, "retries": 0, "high_watermark": 0,
+                      "messages": 0, "rate_limited": 0, "spilled": 0}
+
+    def start(self):
+        self._stop.clear()
+        self._abort.clear()
+        self._resend_spilled()
+        self._threads = [t for t in self._threads if t.is_alive()]
+        for i in range(len(self._threads), self.workers):
+            t = threading.Thread(target=self._worker, name=f"telegram-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        deadline = time.monotonic() + (self.shutdown_timeout if timeout is None else timeout)
+        for t in self._threads:
+            t.join(max(0, deadline - time.monotonic()))
+        if self.queue.unfinished_tasks == 0:
+            return
+        self._abort.set()
+        # Request đang bay có timeout 10s: chờ nó xong để không ghi ra đĩa tin đã gửi rồi
+        for t in self._threads:
+            t.join(11)
+        self._spill()
+
+    def _spill(self):
+        items = []
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            for chat, pending in self._pending.items():
+                items += [(msg, event_ts, -neg_risk, chat) for neg_risk, _, msg, event_ts in pending]
+            self._pending = {}
+            done = len(items)
+            # Thread vẫn kẹt ở request: ghi cả batch của nó (thà gửi trùng còn hơn mất)
+            for chat, batch in list(self._inflight.values()):
+                items += [(msg, event_ts, -neg_risk, chat) for neg_risk, _, msg, event_ts in batch]
+        if not items:
+            return
+        if not self.spill_path:
+            self.log_func(f"[-] Shutdown deadline reached, {len(items)} alert(s) not delivered")
+        else:
+            try:
+                with open(self.spill_path, "a", encoding="utf-8") as f:
+                    for msg, event_ts, risk, chat in items:
+                        f.write(json.dumps({"text": msg, "event_ts": event_ts, "risk": risk, "chat": chat},
+                                           ensure_ascii=False) + "\n")
+                with self._lock: self.stats["spilled"] += len(items)
+                self.log_func(f"[*] Shutdown deadline reached, {len(items)} undelivered alert(s) saved to {self.spill_path}")
+            except OSError as e:
+                self.log_func(f"[-] Could not save undelivered alerts ({e}), {len(items)} alert(s) lost")
+        for _ in range(done):
+            self.queue.task_done()
+
+    def _resend_spilled(self):
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return
+        try:
+            with open(self.spill_path, encoding="utf-8") as f:
+                items = [json.loads(line) for line in f if line.strip()]
+            os.remove(self.spill_path)
+        except (OSError, ValueError) as e:
+            self.log_func(f"[-] Could not read undelivered alerts from {self.spill_path}: {e}")
+            return
+        # Không áp max_queue: các tin này đã được checkpoint bỏ qua, bỏ nữa là mất hẳn
+        for item in items:
+            self.queue.put_nowait((item["text"], item.get("event_ts"), item.get("risk", 0), item.get("chat") or self.chat_id))
+        with self._lock: self.stats["queued"] += len(items)
+        if items:
+            self.log_func(f"[*] Resending {len(items)} undelivered alert(s) from previous run")
+
+    def submit(self, msg, event_ts=None, risk=0, chat_id=None):
+        with self._lock:
+            full = self.queue.unfinished_tasks >= self.max_queue
+            if full:
+                self.stats["dropped"] += 1
+                dropped = self.stats["dropped"]
+            else:
+                self.queue.put_nowait((msg, event_ts, risk, chat_id or self.chat_id))
+                self.stats["queued"] += 1
+                self.stats["high_watermark"] = max(self.stats["high_watermark"], self.queue.unfinished_tasks)
+        if full:
+            DROPPED.inc()
+            self.log_func(f"[-] Alert queue full ({self.max_queue}), dropped message (total dropped: {dropped})")
+            return False
+        return True
+
+    def metrics(self):
+        with self._lock:
+            snap = dict(self.stats)
+            snap["depth"] = self.queue.unfinished_tasks
+        snap["capacity"] = self.max_queue
+        return snap
+
+    def _bucket(self, chat):
+        with self._lock:
+            bucket = self._buckets.get(chat)
+            if bucket is None:
+                bucket = self._buckets[chat] = TokenBucket(self.rate, self.burst)
+            return bucket
+
+    def _stash(self, item):
+        msg, event_ts, risk, chat = item
+        msg = fit_message(msg, self.max_length)
+        with self._lock:
+            self._pending.setdefault(chat, []).append((-risk, next(self._seq), msg, event_ts))
+
+    def _take_batch(self, chat):
+        # Gom mọi tin đã tới trong lúc chờ token -> 1 digest, risk cao trước
+        while True:
+            try:
+                self._stash(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            batch, rest = pack_digest(sorted(self._pending.pop(chat, ())), self.max_length)
+            if rest:
+                self._pending[chat] = rest
+        return batch
+
+    def _worker(self):
+        # Khi stop: xả nốt hàng đợi rồi mới thoát
+        while not self._abort.is_set() and not (self._stop.is_set() and self.queue.unfinished_tasks == 0):
+            with self._lock:
+                idle = not self._pending
+            try:
+                # Còn tin chờ gom thì không ngồi chờ queue
+                self._stash(self.queue.get(timeout=0.5) if idle else self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            with self._lock:
+                chat = next(iter(self._pending), None)
+            if chat is None:
+                continue
+            if not self._bucket(chat).acquire(self._abort):
+                break
+            batch = self._take_batch(chat)
+            if batch:
+                self._inflight[threading.get_ident()] = (chat, batch)
+                try:
+                    self._send_batch(chat, batch)
+                finally:
+                    self._inflight.pop(threading.get_ident(), None)
+
+    def _requeue(self, chat, items):
+        # Bị ngắt giữa chừng khi dừng: trả về hàng chờ để _spill ghi ra đĩa
+        with self._lock:
+            self._pending.setdefault(chat, []).extend(items)
+
+    def _send_batch(self, chat, batch):
+        status = self._deliver(chat, DIGEST_SEP.join(item[2] for item in batch))
+        if status != 200 and self._abort.is_set():
+            return self._requeue(chat, batch)
+        if status != 200 and len(batch) > 1 and status and 400 <= status < 500:
+            # 1 tin lỗi nội dung (vd. HTML hỏng) không kéo cả digest theo: gửi lẻ từng tin
+            for i, item in enumerate(batch):
+                status = self._deliver(chat, item[2]) if self._bucket(chat).acquire(self._abort) else None
+                if status != 200 and self._abort.is_set():
+                    return self._requeue(chat, batch[i:])
+                self._finish([item], status)
+            return
+        self._finish(batch, status)
+
+    def _finish(self, items, status):
+        if status == 200:
+            SENT.inc(len(items))
+            now = time.time()
+            for item in items:
+                if item[3]:
+                    E2E_SECONDS.observe(max(0.0, now - item[3]))
+        else:
+            FAILED.inc(len(items))
+        with self._lock:
+            self.stats["sent" if status == 200 else "failed"] += len(items)
+        for _ in items:
+            self.queue.task_done()
+
+    def _deliver(self, chat, msg):
+        # Trả về status code cuối cùng (None = lỗi mạng). Gọi khi đã có token của chat.
+        payload = {'chat_id': chat, 'text': msg, 'parse_mode': 'HTML'}
+        bucket = self._bucket(chat)
+        error = status = None
+        attempt = 0
+        while True:
+            try:
+                start = time.perf_counter()
+                res = self.session.post(self.url, data=payload, timeout=10)
+                SEND_SECONDS.observe(time.perf_counter() - start)
+                status = res.status_code
+                if status == 200:
+                    DIGESTS.inc()
+                    with self._lock: self.stats["messages"] += 1
+                    return status
+                error = f"{status}: {res.text[:200]}"
+                if status == 429:
+                    # Flood control: chờ đúng retry_after rồi gửi lại; không tính vào max_retries vì tin chỉ bị hoãn
+                    RATE_LIMITED.inc()
+                    with self._lock: self.stats["rate_limited"] += 1
+                    bucket.pause(retry_after(res))
+                    if not bucket.acquire(self._abort):
+                        return status
+                    continue
+                # 4xx là lỗi nội dung/cấu hình -> retry cũng vô ích
+                if 400 <= status < 500:
+                    break
+            except requests.RequestException as e:
+                error, status = str(e), None
+            attempt += 1
+            if attempt > self.max_retries:
+                break
+            with self._lock: self.stats["retries"] += 1
+            self._abort.wait(self.backoff * 2 ** (attempt - 1) + random.uniform(0, self.backoff))
+            if not bucket.acquire(self._abort):
+                return status
+        self.log_func(f"[-] Telegram Error ({error})")
+        return status
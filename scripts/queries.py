@@ -0,0 +1,131 @@
+PAGE_SIZE = 1000
+EVIDENCE_MAX = 500
+
+# Chỉ lấy các field thực sự render ra Telegram, evidence lấy riêng qua script_fields
+SOURCE_FIELDS = [
+    "@timestamp",
+    "kibana.alert.rule.name",
+    "kibana.alert.rule.risk_score",
+    "user.name",
+    "winlog.user.name",
+    "process.name",
+    "process.parent.name",
+]
+EVIDENCE_PATHS = ["powershell.file.script_block_text", "process.command_line", "source.ip", "host.ip"]
+
+# Lấy giá trị đầu tiên khác rỗng trong params.paths, hỗ trợ cả key dạng phẳng ("a.b.c")
+# lẫn object lồng nhau trong _source. Kết quả nằm trong biến `value`.
+FIELD_LOOKUP = """
+String value = null;
+def src = params['_source'];
+for (String p : params.paths) {
+  def v = src[p];
+  if (v == null) {
+    v = src;
+    for (String k : p.splitOnToken('.')) {
+      if (v instanceof Map) { v = v[k]; } else { v = null; break; }
+    }
+  }
+  if (v != null) {
+    String s = v.toString().trim();
+    if (s.length() > 0) { value = s; break; }
+  }
+}
+"""
+
+# Trả về [evidence đã cắt EVIDENCE_MAX ký tự, SHA-1 (hex) của bản đầy đủ] -> fingerprint vẫn phân biệt
+# được evidence dài khác nhau mà không phải kéo cả script block về client.
+# Không dùng hashCode(): chỉ 32 bit, evidence khác nhau trùng hash sẽ bị gộp/khử trùng lặp nhầm.
+EVIDENCE_SCRIPT = FIELD_LOOKUP + """
+if (value == null) { return null; }
+return [value.length() > params.max ? value.substring(0, params.max) : value, value.sha1()];
+"""
+
+# Runtime field cho aggregation: cùng khóa với AlertRecord.evidence_key / user ở chế độ client
+EVIDENCE_KEY_SCRIPT = FIELD_LOOKUP + "emit(value == null ? 'N/A' : value.sha1());"
+USER_SCRIPT = FIELD_LOOKUP + "emit(value == null ? 'Unknown' : value);"
+USER_PATHS = ["user.name", "winlog.user.name"]
+
+
+def evidence_script_field():
+    return {"evidence": {"script": {"lang": "painless", "source": EVIDENCE_SCRIPT,
+                                    "params": {"paths": EVIDENCE_PATHS, "max": EVIDENCE_MAX}}}}
+
+
+def build_poll_query(checkpoint, sort_value=None, size=PAGE_SIZE):
+    query = {
+        "size": size,
+        "_source": SOURCE_FIELDS,
+        "script_fields": evidence_script_field(),
+        "query": {
+            "bool": {
+                "must": [
+                    {
+                        "range": {
+                            "@timestamp": {
+                                "gt": checkpoint
+                            }
+                        }
+                    }
+                ]
+            }
+        },
+        "sort": [
+            {"@timestamp": {"order": "asc"}},
+            {"_doc": {"order": "asc"}}
+        ]
+    }
+    if sort_value:
+        query["search_after"] = sort_value
+    return query
+
+
+def build_aggregation_query(start, end, after_key=None, size=500):
+    composite = {
+        "size": size,
+        "sources": [
+            {"rule": {"terms": {"field": "kibana.alert.rule.name", "missing_bucket": True}}},
+            {"user": {"terms": {"field": "alert_fp_user"}}},
+            {"evidence": {"terms": {"field": "alert_fp_evidence"}}}
+        ]
+    }
+    if after_key:
+        composite["after"] = after_key
+    return {
+        "size": 0,
+        "query": {"bool": {"filter": [{"range": {"@timestamp": {"gt": start, "lte": end}}}]}},
+        "runtime_mappings": {
+            "alert_fp_user": {"type": "keyword", "script": {"source": USER_SCRIPT, "params": {"paths": USER_PATHS}}},
+            "alert_fp_evidence": {"type": "keyword", "script": {"source": EVIDENCE_KEY_SCRIPT, "params": {"paths": EVIDENCE_PATHS}}}
+        },
+        "aggs": {
+            "fingerprints": {
+                "composite": composite,
+                "aggs": {
+                    "latest": {"top_hits": {"size": 1, "sort": [{"@timestamp": {"order": "desc"}}],
+                                            "_source": SOURCE_FIELDS, "script_fields": evidence_script_field()}},
+                    "first_seen": {"min": {"field": "@timestamp"}},
+                    "last_seen": {"max": {"field": "@timestamp"}}
+                }
+            }
+        }
+    }
+
+
+def build_slice_query(pit_id, slice_id, slices, start, end, search_after=None, size=PAGE_SIZE, keep_alive="2m"):
+    # 1 slice của cửa sổ catch-up (start, end] trong point-in-time: các slice chia nhau tập document, không trùng
+    query = {
+        "size": size,
+        "_source": SOURCE_FIELDS,
+        "script_fields": evidence_script_field(),
+        "pit": {"id": pit_id, "keep_alive": keep_alive},
+        "slice": {"id": slice_id, "max": slices},
+        "query": {"bool": {"filter": [{"range": {"@timestamp": {"gt": start, "lte": end}}}]}},
+        "sort": [
+            {"@timestamp": {"order": "asc"}},
+            {"_shard_doc": {"order": "asc"}}
+        ]
+    }
+    if search_after:
+        query["search_after"] = search_after
+    return query
@@ -0,0 +1,54 @@
+import threading
+import time
+
+
+class TokenBucket:
+    # Giới hạn tốc độ kiểu token bucket: rate token/giây, tích tối đa burst token.
+    # pause(): Telegram trả 429 + retry_after -> không phát token nào cho tới hết thời gian chờ
+    def __init__(self, rate, burst=1, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(1.0, float(burst))
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        else:
+            self.tokens = self.burst
+        self.updated = now
+
+    def try_acquire(self):
+        # Lấy 1 token nếu có, trả về 0; không thì trả về số giây cần chờ
+        with self._lock:
+            now = self.clock()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, cancel=None):
+        # cancel: threading.Event, được set thì bỏ chờ và trả về False
+        while True:
+            if cancel is not None and cancel.is_set():
+                return False
+            wait = self.try_acquire()
+            if wait <= 0:
+                return True
+            if cancel is not None:
+                cancel.wait(wait)
+            else:
+                time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            now = self.clock()
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.tokens = 0.0
+            self.updated = max(self.updated, self.blocked_until)
@@ -0,0 +1,97 @@
+import hashlib
+from dateutil import tz, parser
+from queries import EVIDENCE_PATHS, EVIDENCE_MAX
+
+
+def get_field(src, path):
+    # Alert của Kibana lưu lẫn key phẳng ("kibana.alert.rule.name") và object lồng nhau ("user": {"name": ...})
+    value = src.get(path)
+    if value is not None:
+        return value
+    value = src
+    for key in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def evidence_key_of(value):
+    # Cùng khóa với value.sha1() trong EVIDENCE_SCRIPT: dùng khi hit không có script_fields (replay dump, test)
+    if value is None:
+        return "N/A"
+    if isinstance(value, list):
+        value = "[" + ", ".join(str(v) for v in value) + "]"  # giống List.toString() của Java
+    value = str(value).strip()
+    if not value:
+        return "N/A"
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+class AlertRecord:
+    __slots__ = ("id", "timestamp", "sort", "rule", "risk_score", "user", "process", "parent", "evidence", "evidence_key")
+
+    def __init__(self, id, timestamp, sort, rule, risk_score, user, process, parent, evidence, evidence_key):
+        self.id = id
+        self.timestamp = timestamp
+        self.sort = sort
+        self.rule = rule
+        self.risk_score = risk_score
+        self.user = user
+        self.process = process
+        self.parent = parent
+        self.evidence = evidence
+        self.evidence_key = evidence_key
+
+    @classmethod
+    def from_hit(cls, hit):
+        src = hit.get('_source') or {}
+        scripted = (hit.get('fields') or {}).get('evidence')
+        # Script không tìm thấy field evidence -> ES trả [null]: coi như không có script_fields
+        if scripted and scripted[0] is not None:
+            evidence = scripted[0]
+            evidence_key = scripted[1] if len(scripted) > 1 else evidence_key_of(evidence)
+        else:
+            # Hit không có script_fields (vd. dump NDJSON đầy đủ) -> tự lấy evidence từ _source
+            raw = next((v for v in (get_field(src, p) for p in EVIDENCE_PATHS) if v is not None and str(v).strip()), None)
+            evidence_key = evidence_key_of(raw)
+            evidence = str(raw if raw is not None else "N/A").strip()[:EVIDENCE_MAX]
+        return cls(
+            hit['_id'],
+            src['@timestamp'],
+            hit.get('sort'),
+            get_field(src, 'kibana.alert.rule.name') or "Security Alert",
+            get_field(src, 'kibana.alert.rule.risk_score') or 0,
+            get_field(src, 'user.name') or get_field(src, 'winlog.user.name') or "Unknown",
+            get_field(src, 'process.name') or "N/A",
+            get_field(src, 'process.parent.name') or "N/A",
+            evidence,
+            evidence_key,
+        )
+
+    @property
+    def fingerprint(self):
+        return f"{self.rule}|{self.user}|{self.evidence_key}"
+
+
+def _local_hms(ts):
+    return parser.isoparse(ts).astimezone(tz.tzlocal()).strftime('%H:%M:%S')
+
+
+def render_message(env_label, record, count, last_time, first_time=None):
+    risk_score = record.risk_score
+    icon = "🔴" if risk_score >= 70 else "🟡" if risk_score >= 40 else "🔵"
+    local_time = _local_hms(last_time)
+    if first_time and first_time != last_time:
+        local_time = f"{_local_hms(first_time)} → {local_time}"
+    attempt_str = f" (x{count})" if count > 1 else ""
+    return (f"{icon} <b>{env_label} RISK ALERT{attempt_str}</b>\n"
+            f"Risk Score: <code>{risk_score}</code>\n"
+            f"━━━━━━━━━━━━━━━━━━━━━\n"
+            f"- Time: <code>{local_time}</code> | User: <code>{record.user}</code>\n"
+            f"- Rule: <i>{record.rule}</i>\n"
+            f"─────────────────────\n"
+            f"- Parent: <code>{record.parent.upper()}</code>\n"
+            f"- Process: <code>{record.process.upper()}</code>\n"
+            f"- Evidence:\n<code>{str(record.evidence).strip()[:EVIDENCE_MAX]}</code>\n"
+            f"━━━━━━━━━━━━━━━━━━━━━")
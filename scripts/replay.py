@@ -0,0 +1,198 @@
+import argparse
+import gzip
+import json
+import os
+import queue
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+# Replay offline: đưa dump NDJSON alert qua đúng luồng xử lý của run_logic (dedup, fingerprint, gộp, render)
+# mà không cần Elasticsearch/Telegram. Dùng để ước lượng tải khi có sự cố lớn và chỉnh tham số gộp trên dữ liệu thật.
+
+
+def iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class VirtualClock:
+    # Đồng hồ ảo theo @timestamp của dữ liệu: cửa sổ gộp tính theo thời gian sự kiện, không theo giờ máy
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CaptureNotifier:
+    # Thay TelegramNotifier: ghi lại các tin lẽ ra đã gửi (thời điểm ảo, độ trễ so với alert cuối trong nhóm)
+    def __init__(self, clock, out=None):
+        self.clock = clock
+        self.out = out
+        self.queue = queue.Queue()
+        self.log_func = print
+        self.delays = []
+        self.stats = {"queued": 0, "sent": 0, "failed": 0, "dropped": 0, "retries": 0, "high_watermark": 0}
+
+    def start(self):
+        pass
+
+    def stop(self, timeout=5):
+        pass
+
+    def submit(self, msg, event_ts=None, risk=0, chat_id=None):
+        now = self.clock()
+        self.stats["queued"] += 1
+        self.stats["sent"] += 1
+        if event_ts:
+            self.delays.append(max(0.0, now - event_ts))
+        if self.out:
+            self.out.write(json.dumps({"at": iso(now), "event": iso(event_ts) if event_ts else None, "text": msg},
+                                      ensure_ascii=False) + "\n")
+        return True
+
+    def metrics(self):
+        return dict(self.stats, depth=0, capacity=0)
+
+
+def read_hits(path, stats):
+    # Nhận cả hit ({_id, _source}) lẫn document trần (elasticdump, _source export); sort = [@timestamp ms, thứ tự dòng]
+    from dateutil import parser
+    opener = gzip.open if path.endswith(".gz") else open
+    last = None
+    with (sys.stdin if path == "-" else opener(path, "rt", encoding="utf-8")) as f:
+        for n, line in enumerate(f):
+            if not line.strip():
+                continue
+            doc = json.loads(line)
+            hit = doc if "_source" in doc else {"_id": doc.get("kibana.alert.uuid") or doc.get("_id") or f"line-{n}", "_source": doc}
+            try:
+                ts = parser.isoparse(hit["_source"]["@timestamp"]).timestamp()
+            except (KeyError, TypeError, ValueError):
+                stats["skipped"] += 1
+                continue
+            if last is not None and ts < last:
+                stats["out_of_order"] += 1
+            if last is None:
+                stats["first"] = ts
+            last = ts if last is None else max(last, ts)
+            stats["last"] = last
+            hit["sort"] = [int(ts * 1000), n]
+            yield ts, hit
+
+
+def replay(monitor, target, hits, clock, page_size, idle_interval, speed=0.0, stats=None):
+    # Mô phỏng _poll_loop: mỗi lần poll lấy tối đa page_size alert có @timestamp <= thời điểm poll;
+    # page đầy thì poll tiếp ngay (catch-up), không thì lần poll sau cách idle_interval (thời gian ảo).
+    # speed = 0: chạy nhanh nhất có thể; speed = N: phát lại nhanh gấp N lần khoảng cách @timestamp gốc.
+    from dateutil import parser
+    stats = stats if stats is not None else {}
+    stats.setdefault("late", 0)
+    polls = pages = 0
+    cutoff = None  # @timestamp của checkpoint: query thật chỉ lấy alert "gt checkpoint"
+    nxt = next(hits, None)
+    if nxt is None:
+        return polls, pages
+    first = poll_at = nxt[0]
+    wall0 = time.monotonic()
+    while nxt is not None:
+        if speed > 0:
+            time.sleep(max(0.0, wall0 + (poll_at - first) / speed - time.monotonic()))
+        clock.now = max(clock.now, poll_at)
+        monitor.flush_coalesced(target)
+        polls += 1
+        page = []
+        while nxt is not None and nxt[0] <= clock.now and len(page) < page_size:
+            if cutoff is not None and nxt[0] <= cutoff:
+                # Alert tới trễ hơn checkpoint: poller thật sẽ không bao giờ thấy
+                stats["late"] += 1
+            else:
+                page.append(nxt[1])
+            nxt = next(hits, None)
+        if page:
+            pages += 1
+            monitor.ingest_page(target, page)
+            cutoff = parser.isoparse(target.last_checkpoint).timestamp()
+        if len(page) == page_size:
+            continue
+        poll_at = clock.now + idle_interval
+        if nxt is not None and nxt[0] > poll_at and speed <= 0:
+            # Khoảng lặng: nhảy thẳng tới alert kế tiếp (cửa sổ gộp đã hết hạn sẽ đóng ở lần poll đó)
+            poll_at = nxt[0]
+    return polls, pages
+
+
+def _pct(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Replay dump NDJSON alert qua alert pipeline (không cần Elasticsearch/Telegram)")
+    ap.add_argument("dump", help="file NDJSON (.gz được), '-' = stdin")
+    ap.add_argument("--out", help="ghi các tin nhắn lẽ ra đã gửi ra file JSONL")
+    ap.add_argument("--stats", help="ghi thống kê ra file JSON")
+    ap.add_argument("--speed", type=float, default=0, help="0 = nhanh nhất có thể, N = nhanh gấp N lần thời gian thật")
+    ap.add_argument("--sort", action="store_true", help="nạp hết dump vào RAM và sắp theo @timestamp trước khi replay")
+    ap.add_argument("--window", help="ghi đè ALERT_COALESCE_WINDOW (giây)")
+    ap.add_argument("--renotify", help="ghi đè ALERT_RENOTIFY_AT, vd. 10,100,1000")
+    ap.add_argument("--page-size", type=int, help="số alert mỗi lần poll (mặc định PAGE_SIZE của queries.py)")
+    ap.add_argument("--idle-interval", type=float, help="giây giữa 2 lần poll khi không còn backlog (mặc định ALERT_IDLE_INTERVAL)")
+    ap.add_argument("--label", default="REPLAY", help="nhãn môi trường hiển thị trong tin nhắn")
+    args = ap.parse_args(argv)
+
+    if args.window is not None: os.environ["ALERT_COALESCE_WINDOW"] = args.window
+    if args.renotify is not None: os.environ["ALERT_RENOTIFY_AT"] = args.renotify
+    # Không resume/ghi đè checkpoint của monitor thật
+    os.environ["ALERT_CHECKPOINT_FILE"] = os.path.join(tempfile.mkdtemp(prefix="replay-"), "{label}.json")
+    os.environ["ALERT_METRICS_SUMMARY"] = "0"
+
+    from alert import AlertMonitor, DEDUP_DROPS, PAGE_SECONDS
+    from queries import PAGE_SIZE
+    clock = VirtualClock()
+    out = open(args.out, "w", encoding="utf-8") if args.out else None
+    notifier = CaptureNotifier(clock, out)
+    monitor = AlertMonitor(targets=[(args.label.upper(), "replay")], notifier=notifier, clock=clock)
+    target = monitor.targets[0]
+    stats = {"skipped": 0, "out_of_order": 0, "late": 0, "first": 0, "last": 0}
+    hits = read_hits(args.dump, stats)
+    if args.sort:
+        hits = iter(sorted(hits, key=lambda h: h[1]["sort"]))
+    idle = args.idle_interval if args.idle_interval is not None else float(os.getenv("ALERT_IDLE_INTERVAL", "2"))
+
+    t0 = time.perf_counter()
+    try:
+        polls, pages = replay(monitor, target, hits, clock, args.page_size or PAGE_SIZE, idle, args.speed, stats)
+        monitor.flush_coalesced(target, force=True)
+    finally:
+        if out: out.close()
+    wall = time.perf_counter() - t0
+
+    docs = target.stats["hits"]
+    sent = notifier.stats["sent"]
+    report = {
+        "documents": docs, "skipped": stats["skipped"], "out_of_order": stats["out_of_order"],
+        "late_missed": stats["late"],
+        "duplicates": int(DEDUP_DROPS.total()), "event_span_seconds": round(stats["last"] - stats["first"], 1),
+        "polls": polls, "pages": pages,
+        "groups": target.stats["groups"], "messages": sent,
+        "alerts_per_message": round(docs / sent, 1) if sent else None,
+        "notify_delay_p50": _pct(notifier.delays, 0.5), "notify_delay_p95": _pct(notifier.delays, 0.95),
+        "coalescer": dict(target.coalescer.stats),
+        "wall_seconds": round(wall, 3), "docs_per_second": round(docs / wall, 1) if wall else None,
+        "page_p95_ms": round(PAGE_SECONDS.quantile(0.95) * 1000, 2) if PAGE_SECONDS.quantile(0.95) is not None else None,
+        "settings": {"window": target.coalescer.window, "renotify": target.coalescer.thresholds,
+                     "page_size": args.page_size or PAGE_SIZE, "idle_interval": idle, "speed": args.speed},
+    }
+    print(json.dumps(report, indent=2))
+    if args.stats:
+        with open(args.stats, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
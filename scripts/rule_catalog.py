@@ -0,0 +1,131 @@
+import os
+import threading
+from checkpoint import CheckpointStore
+from rule_scan import iter_rule_files, scan_rules, RULE_EXTS
+
+CATALOG_VERSION = 3
+
+
+class RuleCatalog:
+    # Chỉ mục rule lưu trên đĩa, khóa theo path + (mtime, size, hash); chỉ parse lại file đã đổi
+    def __init__(self, rules_dir, path=".rule_catalog.json"):
+        self.rules_dir = rules_dir
+        self.store = CheckpointStore(path)
+        self.entries = {}
+        # GUI (main thread) và các thread delete/audit cùng đọc/ghi catalog
+        self.lock = threading.RLock()
+
+    def load(self):
+        data = self.store.load()
+        if data and data.get("version") == CATALOG_VERSION and data.get("rules_dir") == self.rules_dir:
+            self.entries = data.get("entries", {})
+        return len(self.entries)
+
+    def save(self):
+        self.store.save({"version": CATALOG_VERSION, "rules_dir": self.rules_dir, "entries": self.entries})
+
+    def refresh(self):
+        with self.lock:
+            fresh, stale = {}, {}
+            for p in iter_rule_files(self.rules_dir):
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                old = self.entries.get(p)
+                if old and old["mtime"] == st.st_mtime_ns and old["size"] == st.st_size:
+                    fresh[p] = old
+                else:
+                    fresh[p] = None
+                    stale[p] = (st, old)
+
+            # mtime đổi nhưng nội dung y hệt (git checkout, copy lại file) -> scan trả "unchanged", dùng lại entry cũ
+            known = {p: old["hash"] for p, (_, old) in stale.items() if old}
+            for info in scan_rules(paths=list(stale), known=known):
+                p = info["path"]
+                st, old = stale[p]
+                entry = dict(old) if info.get("unchanged") else {k: info[k] for k in ("hash", "id", "title", "status", "tags")}
+                entry.update(mtime=st.st_mtime_ns, size=st.st_size)
+                fresh[p] = entry
+
+            fresh = {p: e for p, e in fresh.items() if e is not None}
+            changed = bool(stale) or fresh.keys() != self.entries.keys()
+            self.entries = fresh
+            if changed:
+                try:
+                    self.save()
+                except OSError:
+                    pass
+            return len(stale)
+
+    def key_for(self, path):
+        # Đưa path tuyệt đối/tương đối (từ watcher) về cùng dạng key mà os.walk(rules_dir) sinh ra
+        rel = os.path.relpath(os.path.abspath(path), os.path.abspath(self.rules_dir))
+        if rel == os.curdir:
+            return self.rules_dir
+        if rel.startswith(os.pardir):
+            return None
+        return os.path.join(self.rules_dir, rel)
+
+    def update_paths(self, paths):
+        # Cập nhật catalog chỉ cho các path bị đụng tới (file hoặc thư mục), trả về tập key đã thay đổi
+        with self.lock:
+            touched = set()
+            for path in paths:
+                key = self.key_for(path)
+                if key is None:
+                    continue
+                if os.path.isdir(key):
+                    touched.update(iter_rule_files(key))
+                prefix = os.path.join(os.path.normpath(key), "")
+                touched.update(p for p in self.entries if p == key or os.path.normpath(p).startswith(prefix))
+                if os.path.isfile(key) and key.lower().endswith(RULE_EXTS):
+                    touched.add(key)
+
+            stale, affected = {}, set()
+            for p in touched:
+                old = self.entries.get(p)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    if self.entries.pop(p, None) is not None:
+                        affected.add(p)
+                    continue
+                if not (old and old["mtime"] == st.st_mtime_ns and old["size"] == st.st_size):
+                    stale[p] = (st, old)
+
+            known = {p: old["hash"] for p, (_, old) in stale.items() if old}
+            for info in scan_rules(paths=list(stale), known=known):
+                p = info["path"]
+                st, old = stale[p]
+                entry = dict(old) if info.get("unchanged") else {k: info[k] for k in ("hash", "id", "title", "status", "tags")}
+                entry.update(mtime=st.st_mtime_ns, size=st.st_size)
+                # chỉ touch (mtime đổi, nội dung giữ nguyên) thì vẫn lưu mtime mới nhưng không báo thay đổi
+                if not old or entry["hash"] != old["hash"]:
+                    affected.add(p)
+                self.entries[p] = entry
+            if stale or affected:
+                try:
+                    self.save()
+                except OSError:
+                    pass
+            return affected
+
+    def rule_view(self, path):
+        e = self.entries.get(path)
+        if not e or e["title"] is None:
+            return None
+        return {"path": path, "file": os.path.basename(path), "title": e["title"],
+                "status": 'OFF' if e["status"] == 'deprecated' else 'ON', "id": e["id"], "tags": e.get("tags", [])}
+
+    def rules(self):
+        with self.lock:
+            return [r for r in map(self.rule_view, self.entries) if r]
+
+    def ids_under(self, target):
+        # {rule_id: path} cho 1 file hoặc cả thư mục, lấy từ catalog thay vì mở lại từng file
+        with self.lock:
+            target = os.path.normpath(target)
+            prefix = os.path.join(target, "")
+            return {e["id"]: p for p, e in self.entries.items()
+                    if e["id"] and (os.path.normpath(p) == target or os.path.normpath(p).startswith(prefix))}
@@ -0,0 +1,64 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader  # libyaml, nhanh hơn ~10 lần
+except ImportError:
+    from yaml import SafeLoader
+
+RULE_EXTS = ('.yml', '.yaml')
+PARALLEL_THRESHOLD = int(os.getenv("RULE_SCAN_PARALLEL_MIN", "400"))
+
+
+def iter_rule_files(target):
+    if os.path.isfile(target):
+        if target.lower().endswith(RULE_EXTS):
+            yield target
+        return
+    for root, _, files in os.walk(target):
+        for f in files:
+            if f.lower().endswith(RULE_EXTS):
+                yield os.path.join(root, f)
+
+
+def parse_rule(path, known_hash=None):
+    # Kết quả: path, hash, id, title, status (chữ thường), tags, error. Nếu hash trùng known_hash -> "unchanged"
+    info = {"path": path, "hash": None, "id": None, "title": None, "status": None, "tags": [], "error": None}
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read()
+        info["hash"] = hashlib.sha1(raw).hexdigest()
+        if known_hash and known_hash == info["hash"]:
+            info["unchanged"] = True
+            return info
+        d = yaml.load(raw, Loader=SafeLoader)
+    except (OSError, yaml.YAMLError) as e:
+        info["error"] = str(e)
+        return info
+    if isinstance(d, dict) and d:
+        info["id"] = d.get('id')
+        info["title"] = d.get('title', 'N/A')
+        info["status"] = str(d.get('status', '')).lower()
+        tags = d.get('tags')
+        info["tags"] = [str(t) for t in tags] if isinstance(tags, list) else []
+    elif d:
+        info["error"] = f"expected a mapping, got {type(d).__name__}"
+    return info
+
+
+def _parse_job(job):
+    return parse_rule(*job)
+
+
+def scan_rules(target=None, paths=None, known=None, workers=None):
+    # Quét 1 lượt: stream kết quả theo thứ tự file; cây lớn thì parse song song trên process pool
+    known = known or {}
+    jobs = [(p, known.get(p)) for p in (paths if paths is not None else iter_rule_files(target))]
+    if len(jobs) < PARALLEL_THRESHOLD or (workers or os.cpu_count() or 1) <= 1:
+        for job in jobs:
+            yield _parse_job(job)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(_parse_job, jobs, chunksize=max(16, len(jobs) // ((workers or os.cpu_count() or 1) * 8)))
@@ -0,0 +1,112 @@
+import bisect
+import os
+import threading
+
+
+class RuleIndex:
+    # Chỉ mục tìm kiếm rule (title, tên file, thư mục, tags, rule id), cập nhật theo từng rule.
+    # Toàn bộ chuỗi tìm kiếm đã lowercase được ghép thành 1 corpus, str.find (C) quét thay cho vòng lặp Python
+    def __init__(self):
+        self.rows = {}      # path -> row (như RuleCatalog.rule_view)
+        self.text = {}      # path -> chuỗi tìm kiếm đã lowercase
+        self.seq = {}       # path -> thứ tự hiển thị, giữ nguyên khi rule được cập nhật
+        self.folders = {}   # folder -> [số rule, tên thư mục lowercase]
+        self._next = 0
+        self._corpus = None  # (corpus, offsets, paths), dựng lại lười sau khi có thay đổi
+        # load_rules_data có thể chạy từ thread delete/deploy trong lúc main thread đang tìm
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    @staticmethod
+    def haystack(row):
+        folder = os.path.basename(os.path.dirname(row['path']))
+        parts = [row['title'], row['file'], folder, row.get('id') or '', *row.get('tags', ())]
+        # Ngăn cách bằng \n để 1 token (không chứa khoảng trắng) không khớp xuyên qua 2 trường
+        return "\n".join(str(p) for p in parts).lower()
+
+    def put(self, row):
+        with self.lock:
+            p = row['path']
+            old = self.rows.get(p)
+            if old == row:
+                return False
+            if old:
+                self._unlink(p)
+            else:
+                self.seq[p] = self._next
+                self._next += 1
+            self.rows[p], self.text[p] = row, self.haystack(row)
+            folder = os.path.dirname(p)
+            self.folders.setdefault(folder, [0, os.path.basename(folder).lower()])[0] += 1
+            self._corpus = None
+            return True
+
+    def discard(self, path):
+        with self.lock:
+            if path not in self.rows:
+                return False
+            self._unlink(path)
+            del self.rows[path], self.text[path], self.seq[path]
+            self._corpus = None
+            return True
+
+    def _unlink(self, path):
+        folder = os.path.dirname(path)
+        entry = self.folders.get(folder)
+        if entry:
+            entry[0] -= 1
+            if entry[0] <= 0:
+                del self.folders[folder]
+
+    def sync(self, rows):
+        # Đồng bộ với danh sách đầy đủ: chỉ đụng tới rule mới/đổi/mất, trả về số rule thay đổi
+        with self.lock:
+            seen, changed = set(), 0
+            for row in rows:
+                seen.add(row['path'])
+                changed += self.put(row)
+            for p in [p for p in self.rows if p not in seen]:
+                changed += self.discard(p)
+            return changed
+
+    def rules(self):
+        with self.lock:
+            return sorted(self.rows.values(), key=lambda r: self.seq[r['path']])
+
+    def _snapshot(self):
+        with self.lock:
+            if self._corpus is None:
+                paths = sorted(self.rows, key=self.seq.__getitem__)
+                offsets, pos = [], 0
+                for p in paths:
+                    offsets.append(pos)
+                    pos += len(self.text[p]) + 1
+                self._corpus = ("\0".join(self.text[p] for p in paths), offsets, paths)
+            return self._corpus
+
+    def search(self, term):
+        # Generator theo thứ tự hiển thị: caller chỉ lấy đủ số dòng cần vẽ, không phải quét hết cây
+        tokens = term.lower().split()
+        if not tokens:
+            return
+        corpus, offsets, paths = self._snapshot()
+        first, n = max(tokens, key=len), len(paths)
+        start = 0
+        while True:
+            hit = corpus.find(first, start)
+            if hit < 0:
+                return
+            i = bisect.bisect_right(offsets, hit) - 1
+            end = offsets[i + 1] - 1 if i + 1 < n else len(corpus)
+            if all(t in corpus[offsets[i]:end] for t in tokens):
+                yield paths[i]
+            start = end + 1
+
+    def search_folders(self, term):
+        tokens = term.lower().split()
+        if not tokens:
+            return []
+        with self.lock:
+            return [f for f, (_, name) in self.folders.items() if all(t in name for t in tokens)]
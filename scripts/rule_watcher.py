@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from rule_scan import RULE_EXTS
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # không có watchdog -> dùng polling
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class _Handler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.event_type not in ("created", "modified", "deleted", "moved"):
+            return
+        paths = [event.src_path]
+        if event.event_type == "moved":
+            paths.append(event.dest_path)
+        # Sự kiện "modified" của thư mục chỉ là mtime thư mục đổi, file con sẽ có event riêng
+        if event.is_directory and event.event_type == "modified":
+            return
+        self.watcher.push(event.event_type, paths, event.is_directory)
+
+
+class RuleWatcher:
+    # Theo dõi thư mục rule (inotify/FSEvents/ReadDirectoryChanges qua watchdog, hoặc polling),
+    # gom các sự kiện liên tiếp (git pull, ingest cả thư mục) thành 1 lô rồi mới gọi on_batch(paths)
+    def __init__(self, paths, on_batch, debounce=0.5, max_wait=5.0, poll_interval=2.0):
+        self.paths = [p for p in paths if p]
+        self.on_batch = on_batch
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.backend = "watchdog" if Observer else "polling"
+        self._pending = set()
+        self._first = self._last = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._observer = None
+
+    def start(self):
+        for p in self.paths:
+            os.makedirs(p, exist_ok=True)
+        if Observer:
+            self._observer = Observer()
+            handler = _Handler(self)
+            for p in self.paths:
+                self._observer.schedule(handler, p, recursive=True)
+            self._observer.daemon = True
+            self._observer.start()
+        else:
+            threading.Thread(target=self._poll_loop, name="rule-watch-poll", daemon=True).start()
+        threading.Thread(target=self._debounce_loop, name="rule-watch-debounce", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._observer:
+            self._observer.stop()
+
+    def push(self, kind, paths, is_dir=False):
+        if not is_dir and not any(p.lower().endswith(RULE_EXTS) for p in paths):
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not self._pending:
+                self._first = now
+            self._pending.update(paths)
+            self._last = now
+
+    def _debounce_loop(self):
+        while not self._stop.wait(0.1):
+            now = time.monotonic()
+            with self._lock:
+                if not self._pending or (now - self._last < self.debounce and now - self._first < self.max_wait):
+                    continue
+                batch, self._pending = self._pending, set()
+            try:
+                self.on_batch(batch)
+            except Exception as e:
+                print(f"[-] Rule watcher error: {e}")
+
+    def _snapshot(self):
+        snap = {}
+        for base in self.paths:
+            for root, _, files in os.walk(base):
+                for f in files:
+                    if f.lower().endswith(RULE_EXTS):
+                        p = os.path.join(root, f)
+                        try:
+                            st = os.stat(p)
+                            snap[p] = (st.st_mtime_ns, st.st_size)
+                        except OSError:
+                            pass
+        return snap
+
+    def _poll_loop(self):
+        prev = self._snapshot()
+        while not self._stop.wait(self.poll_interval):
+            cur = self._snapshot()
+            changed = [p for p in cur.keys() | prev.keys() if cur.get(p) != prev.get(p)]
+            if changed:
+                self.push("modified", changed)
+            prev = cur
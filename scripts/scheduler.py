@@ -0,0 +1,46 @@
+import random
+import time
+
+
+class PollScheduler:
+    # Quyết định thời gian nghỉ giữa 2 lần poll:
+    # page đầy -> poll tiếp ngay, rỗng/thiếu -> idle_interval, lỗi liên tiếp -> backoff lũy thừa + jitter
+    def __init__(self, idle_interval=2.0, backoff_base=1.0, backoff_max=60.0, jitter=0.3, clock=time.time):
+        self.idle_interval = idle_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.clock = clock
+        self.consecutive_errors = 0
+        self.last_event_ts = None
+        self.last_delay = 0.0
+
+    def on_page(self, count, page_size, last_event_ts=None, backlog=False):
+        self.consecutive_errors = 0
+        if last_event_ts is not None:
+            self.last_event_ts = last_event_ts
+        return self._set(0.0 if count >= page_size or backlog else self.idle_interval)
+
+    def on_idle(self, last_event_ts=None):
+        self.consecutive_errors = 0
+        if last_event_ts is not None:
+            self.last_event_ts = last_event_ts
+        return self._set(self.idle_interval)
+
+    def on_error(self):
+        self.consecutive_errors += 1
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (self.consecutive_errors - 1))
+        return self._set(delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    @property
+    def ingest_lag(self):
+        if self.last_event_ts is None:
+            return None
+        return max(0.0, self.clock() - self.last_event_ts)
+
+    def stats(self):
+        return {"ingest_lag": self.ingest_lag, "consecutive_errors": self.consecutive_errors, "last_delay": self.last_delay}
+
+    def _set(self, delay):
+        self.last_delay = delay
+        return delay
@@ -0,0 +1,90 @@
+import json
+import os
+import time
+from importlib import metadata
+from concurrent.futures import ProcessPoolExecutor
+from checkpoint import CheckpointStore
+
+try:
+    from sigma.collection import SigmaCollection
+    from sigma.rule import SigmaRule
+    from sigma.exceptions import SigmaConversionError, SigmaFeatureNotSupportedByBackendError
+    from sigma.backends.elasticsearch import LuceneBackend
+    from sigma.pipelines.elasticsearch.windows import ecs_windows
+except ImportError:  # chưa cài pySigma -> deploy.py quay về sigma CLI
+    SigmaCollection = None
+
+OUTPUT_FORMAT = "siem_rule_ndjson"
+TOOLCHAIN = ("pysigma", "pysigma-backend-elasticsearch", "sigma-cli")
+CACHE_FILE = "conversions.json"
+PARALLEL_MIN = int(os.getenv("SIGMA_PARALLEL_MIN", "50"))
+
+_backend = None
+
+
+def _version(dist):
+    try:
+        return metadata.version(dist)
+    except metadata.PackageNotFoundError:
+        return "-"
+
+
+# Nâng cấp pySigma/backend/sigma-cli có thể đổi query sinh ra -> key đổi, cache convert và trạng thái deploy cũ bị bỏ
+CONVERT_KEY = "|".join(["lucene", "ecs_windows", OUTPUT_FORMAT] + [f"{d}={_version(d)}" for d in TOOLCHAIN])
+
+
+def available():
+    return SigmaCollection is not None
+
+
+def load_cache(cache_dir):
+    # {hash nội dung rule: dòng NDJSON đã convert (None = unsupported)}, dùng chung cho deploy.py và audit
+    data = CheckpointStore(os.path.join(cache_dir, CACHE_FILE)).load() or {}
+    return data.get("lines", {}) if data.get("key") == CONVERT_KEY else {}
+
+
+def save_cache(cache_dir, lines, live):
+    CheckpointStore(os.path.join(cache_dir, CACHE_FILE)).save(
+        {"key": CONVERT_KEY, "lines": {h: l for h, l in lines.items() if h in live}})
+
+
+def _init_worker():
+    # Backend + pipeline ecs_windows dựng 1 lần cho mỗi process, dùng lại cho mọi rule của worker đó
+    global _backend
+    _backend = LuceneBackend(processing_pipeline=ecs_windows())
+
+
+def convert_file(path):
+    # Kết quả: path, status (ok/skipped/failed), lines (NDJSON giống hệt sigma CLI), error, seconds
+    if _backend is None:
+        _init_worker()
+    t0 = time.perf_counter()
+    res = {"path": path, "status": "ok", "lines": [], "error": None}
+    try:
+        with open(path, encoding='utf-8') as f:
+            collection = SigmaCollection.from_yaml(f.read())
+        for rule in collection.rules:
+            if not isinstance(rule, SigmaRule):
+                continue
+            res["lines"] += [json.dumps(q) for q in _backend.convert_rule(rule, OUTPUT_FORMAT)]
+        if not res["lines"]:
+            res["status"], res["error"] = "skipped", "no query produced"
+    except (SigmaFeatureNotSupportedByBackendError, SigmaConversionError, NotImplementedError) as e:
+        # Tương đương --skip-unsupported: rule backend không hỗ trợ thì bỏ qua, không làm hỏng cả lượt
+        res["status"], res["error"] = "skipped", str(e)
+    except Exception as e:
+        # Rule sai cú pháp/logic: báo lỗi riêng rule đó, không cache để lần deploy sau convert lại
+        res["status"], res["error"] = "failed", f"{type(e).__name__}: {e}"
+    res["seconds"] = time.perf_counter() - t0
+    return res
+
+
+def convert_files(paths, workers=None):
+    # Stream kết quả theo thứ tự paths; ít rule thì convert ngay trong process hiện tại (tránh chi phí spawn)
+    workers = workers or os.cpu_count() or 1
+    if len(paths) < PARALLEL_MIN or workers <= 1:
+        for p in paths:
+            yield convert_file(p)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        yield from pool.map(convert_file, paths, chunksize=max(4, len(paths) // (workers * 8)))